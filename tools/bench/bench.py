@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Offline benchmarks for the gdb tools
+#
+# Usage:
+#   tools/bench/bench.py [--latency <profile|ms>] [--words <n>] [--repeat <n>]
+#
+# Runs find_word, find_word_around, hd and mmap from tools/ against a
+# simulated target (the gdb stand-in in tools/bench/gdb) holding a
+# synthetic dictionary of <n> words in the defword layout and a
+# synthetic four level translation table. Each read_memory waits for the
+# link latency, so the time reported is what a user would see over:
+#   local    - no latency, just the cost of the tools themselves
+#   qemu     - QEMU's gdb stub on the same machine (0.05 ms per read)
+#   openocd  - a JTAG adapter through OpenOCD (2 ms per read)
+# or any latency given in milliseconds.
+#
+# For each benchmark the caches are dropped (as on a stop) and the
+# commands run <repeat> times. Reported are the wall time, the number
+# of read_memory round trips and the bytes moved.
+#
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import runpy
+import struct
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOOLS_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BENCH_DIR)
+import gdb
+
+LATENCY_PROFILES = {
+    'local': 0.0,
+    'qemu': 0.05,
+    'openocd': 2.0,
+}
+
+# Layout of the simulated target
+DOCOL = 0x80010
+DOVAR = 0x80018
+CODE_BASE = 0x81000
+VARIABLES = 0x90000
+DATA_SEGMENT = 0x200000
+DATA_SIZE = 0x400000
+TABLE_BASE = 0x100000
+TABLE_AREA = 0x40000
+
+HEADER_SIZE = 40
+CELL = 8
+
+PRIMITIVES = ['exit', 'lit', 'branch', '0branch', 'litstring', "[']", '(does>)',
+              'dup', 'drop', 'swap', 'over', '+', '-', '@', '!', 'emit']
+
+class Image():
+    def __init__(self, base, size):
+        self.base = base
+        self.data = bytearray(size)
+
+    def put(self, addr, data):
+        offset = addr - self.base
+        self.data[offset:offset + len(data)] = data
+
+    def put_cell(self, addr, value):
+        self.put(addr, struct.pack('<Q', value & 0xffffffffffffffff))
+
+def build_dictionary(image, count, rng):
+    # Primitives first, then colon definitions calling random earlier
+    # words. Returns the names in definition order.
+    here = image.base
+    link = 0
+    cfas = []
+    names = []
+
+    for i in range(count):
+        name = PRIMITIVES[i] if i < len(PRIMITIVES) else 'word%d' % i
+        encoded = name.encode('latin-1')
+        image.put(here, struct.pack('<QBB', link, 0, len(encoded)) + encoded.ljust(30, b','))
+        cfa = here + HEADER_SIZE
+
+        if i < len(PRIMITIVES):
+            body = [CODE_BASE + 16 * i]
+        else:
+            body = [DOCOL]
+            # anything but the primitives that take inline data
+            for _ in range(rng.randint(2, 12)):
+                body.append(rng.choice(cfas[PRIMITIVES.index('dup'):]))
+            body.append(cfas[0])
+
+        for j, value in enumerate(body):
+            image.put_cell(cfa + CELL * j, value)
+
+        link = here
+        here = cfa + CELL * len(body)
+        cfas.append(cfa)
+        names.append(name)
+
+    return names, link, here
+
+def build_tables(image):
+    # L0 -> one L1 table: three 1G blocks and one L2 table, which holds
+    # 2M blocks and eight L3 tables of 4K pages
+    page_attrs = 0x0000000000000703
+    block_attrs = 0x0060000000000401
+
+    l0 = image.base
+    l1 = l0 + 0x1000
+    l2 = l1 + 0x1000
+    image.put_cell(l0, l1 | 0b11)
+
+    image.put_cell(l1, l2 | 0b11)
+    for i in range(1, 4):
+        image.put_cell(l1 + CELL * i, (i << 30) | block_attrs)
+
+    for i in range(512):
+        if i < 8:
+            l3 = l2 + 0x1000 * (i + 1)
+            image.put_cell(l2 + CELL * i, l3 | 0b11)
+            for j in range(512):
+                image.put_cell(l3 + CELL * j, (i << 21) | (j << 12) | page_attrs)
+        else:
+            image.put_cell(l2 + CELL * i, (i << 21) | block_attrs | 0b01)
+
+    return l0
+
+def setup_target(words, seed):
+    rng = random.Random(seed)
+
+    dictionary = Image(DATA_SEGMENT, DATA_SIZE)
+    names, latest, here = build_dictionary(dictionary, words, rng)
+
+    variables = Image(VARIABLES, 0x1000)
+    variables.put_cell(VARIABLES, latest)
+    variables.put_cell(VARIABLES + CELL, here)
+
+    tables = Image(TABLE_BASE, TABLE_AREA)
+    ttbr0 = build_tables(tables)
+
+    for image in (dictionary, variables, tables):
+        gdb.selected_inferior().add_segment(image.base, image.data)
+
+    gdb.symbol_values.update(docol=DOCOL, dovar=DOVAR,
+                             var_latest=VARIABLES, var_here=VARIABLES + CELL,
+                             data_segment=DATA_SEGMENT)
+    gdb.registers.update(TTBR0_EL1=ttbr0, TCR_EL1=0x0000000500803510)
+    # keep the tools from picking up a real kernel ELF from the tree
+    gdb.progspace_filename = os.path.join(BENCH_DIR, 'no-kernel-elf')
+
+    return names, latest, here
+
+def load_tools():
+    with contextlib.redirect_stdout(io.StringIO()):
+        for script in ('words.py', 'hexdump.py', 'cortex-a.py'):
+            runpy.run_path(os.path.join(TOOLS_DIR, script))
+
+def run(commands, repeat):
+    # all the commands run within one stop, as a user would type them
+    gdb.events.stop.fire(gdb.StopEvent())
+    gdb.link.reset()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for command in commands:
+                name, _, arg = command.partition(' ')
+                gdb.commands[name].invoke(arg, False)
+    elapsed = time.perf_counter() - started
+
+    return elapsed, gdb.link.round_trips, gdb.link.bytes
+
+def benchmarks(names, here, rng):
+    yield 'find_word (oldest)', ['find_word %s' % names[0]]
+    yield 'find_word (newest)', ['find_word %s' % names[-1]]
+    yield 'find_word (missing)', ['find_word no-such-word']
+    addrs = [rng.randrange(DATA_SEGMENT, here) for _ in range(100)]
+    yield 'find_word_around x100', ['find_word_around %#x' % addr for addr in addrs]
+    yield 'hd 4K', ['hd %#x 4096' % DATA_SEGMENT]
+    yield 'hd 1M', ['hd %#x %#x > %s' % (DATA_SEGMENT, 0x100000, os.devnull)]
+    yield 'mmap', ['mmap']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the gdb tools against a simulated target')
+    parser.add_argument('--latency', default='qemu',
+                        help='link latency: local, qemu, openocd or milliseconds per read')
+    parser.add_argument('--words', type=int, default=5000, help='words in the synthetic dictionary')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each benchmark between stops')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.latency in LATENCY_PROFILES:
+        latency = LATENCY_PROFILES[args.latency]
+    else:
+        latency = float(args.latency)
+    gdb.link.latency = latency / 1000.0
+
+    names, _, here = setup_target(max(args.words, len(PRIMITIVES) + 1), args.seed)
+    load_tools()
+
+    print('%d words, %.3f ms per read, %d runs per benchmark' % (len(names), latency, args.repeat))
+    print('%-24s %12s %12s %14s' % ('benchmark', 'time (ms)', 'round trips', 'bytes'))
+    rng = random.Random(args.seed)
+    for title, commands in benchmarks(names, here, rng):
+        elapsed, round_trips, moved = run(commands, args.repeat)
+        print('%-24s %12.2f %12d %14d' % (title, 1000.0 * elapsed, round_trips, moved))
+
+if __name__ == '__main__':
+    main()
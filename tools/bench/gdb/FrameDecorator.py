@@ -0,0 +1,24 @@
+class FrameDecorator():
+    def __init__(self, base):
+        self._base = base
+
+    def elided(self):
+        return None
+
+    def function(self):
+        return None
+
+    def address(self):
+        return None
+
+    def filename(self):
+        return None
+
+    def line(self):
+        return None
+
+    def frame_args(self):
+        return None
+
+    def frame_locals(self):
+        return None
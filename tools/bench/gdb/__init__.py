@@ -0,0 +1,205 @@
+# Stand-in for gdb's Python API, for running the tools without gdb
+#
+# Only what the tools in tools/ use is here. Target memory is a set of
+# bytearray segments, registers are a dictionary and symbols resolve
+# through parse_and_eval, so symbols.py falls back to it for every
+# name. Every read_memory counts as one round trip and can be made to
+# wait, to stand in for a slow link.
+#
+
+import shlex
+import time
+from types import SimpleNamespace
+
+COMMAND_NONE = -1
+COMMAND_RUNNING = 0
+COMMAND_DATA = 1
+COMMAND_STACK = 2
+COMMAND_FILES = 3
+COMMAND_SUPPORT = 4
+COMMAND_STATUS = 5
+COMMAND_BREAKPOINTS = 6
+COMMAND_OBSCURE = 7
+COMMAND_USER = 13
+
+PARAM_BOOLEAN = 0
+PARAM_INTEGER = 2
+PARAM_STRING = 3
+
+class error(RuntimeError):
+    pass
+
+class MemoryError(error):
+    pass
+
+class GdbError(Exception):
+    pass
+
+commands = {}
+parameters = {}
+frame_filters = {}
+
+class Command():
+    def __init__(self, name, command_class, completer_class=None, prefix=False):
+        commands[name] = self
+
+    def dont_repeat(self):
+        pass
+
+class Parameter():
+    def __init__(self, name, command_class, parameter_class, enum_sequence=None):
+        self.value = None
+        parameters[name] = self
+
+def parameter(name):
+    return parameters[name].value if name in parameters else None
+
+class Breakpoint():
+    def __init__(self, spec, type=None, wp_class=None, internal=False, temporary=False):
+        self.location = spec
+        self.valid = True
+
+    def is_valid(self):
+        return self.valid
+
+    def delete(self):
+        self.valid = False
+
+class EventRegistry():
+    def __init__(self):
+        self.handlers = []
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    def disconnect(self, handler):
+        self.handlers.remove(handler)
+
+    def fire(self, event=None):
+        for handler in list(self.handlers):
+            handler(event)
+
+events = SimpleNamespace(stop=EventRegistry(),
+                         cont=EventRegistry(),
+                         exited=EventRegistry(),
+                         memory_changed=EventRegistry(),
+                         register_changed=EventRegistry(),
+                         inferior_call=EventRegistry(),
+                         new_objfile=EventRegistry(),
+                         clear_objfiles=EventRegistry())
+
+class StopEvent():
+    pass
+
+class SignalEvent(StopEvent):
+    stop_signal = 'SIGINT'
+
+class BreakpointEvent(StopEvent):
+    pass
+
+# The simulated target
+
+symbol_values = {}
+registers = {}
+progspace_filename = None
+
+class Link():
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.reset()
+
+    def reset(self):
+        self.round_trips = 0
+        self.bytes = 0
+
+link = Link()
+
+class Inferior():
+    num = 1
+    pid = 1
+
+    def __init__(self):
+        self.segments = []
+
+    def add_segment(self, base, data):
+        self.segments.append((base, data))
+
+    def read_memory(self, addr, length):
+        addr = int(addr)
+        link.round_trips += 1
+        link.bytes += length
+        if link.latency:
+            time.sleep(link.latency)
+        for base, data in self.segments:
+            if base <= addr and addr + length <= base + len(data):
+                offset = addr - base
+                return memoryview(bytes(data[offset:offset + length])).cast('c')
+        raise MemoryError('Cannot access memory at address 0x%x' % addr)
+
+_inferior = Inferior()
+
+def selected_inferior():
+    return _inferior
+
+def inferiors():
+    return [_inferior]
+
+class Thread():
+    num = 1
+    global_num = 1
+    ptid = (1, 1, 0)
+
+    def is_valid(self):
+        return True
+
+    def is_running(self):
+        return False
+
+    def switch(self):
+        pass
+
+def selected_thread():
+    return Thread()
+
+class Frame():
+    def read_register(self, name):
+        if name not in registers:
+            raise ValueError('Bad register')
+        return registers[name]
+
+    def pc(self):
+        return registers.get('pc', 0)
+
+def selected_frame():
+    return Frame()
+
+def newest_frame():
+    return Frame()
+
+def objfiles():
+    return []
+
+def current_progspace():
+    return SimpleNamespace(filename=progspace_filename)
+
+def string_to_argv(arg):
+    return shlex.split(arg)
+
+def parse_and_eval(expr):
+    expr = expr.strip()
+    if expr.startswith('(long)&'):
+        expr = expr[len('(long)&'):]
+    if expr.startswith('$') and expr[1:] in registers:
+        return registers[expr[1:]]
+    if expr in symbol_values:
+        return symbol_values[expr]
+    try:
+        return int(eval(expr, {'__builtins__': {}}, dict(symbol_values)))
+    except Exception as e:
+        raise error('No symbol "%s" in current context.' % expr) from e
+
+def execute(command, from_tty=False, to_string=False):
+    raise error('Undefined command: "%s".' % command)
+
+def post_event(event):
+    event()
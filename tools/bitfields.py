@@ -0,0 +1,519 @@
+# Bitfield layouts of the Cortex-A system registers and descriptors
+#
+# Not a command script: cortex-a.py imports it. It does not need gdb,
+# so scripts can decode logged register values offline:
+#
+#   import bitfields
+#   columns = bitfields.ESR_EL1.decode_many(values)
+#   columns['EC']            # one exception class per value
+#
+# Each layout is compiled once from its (low bit, bit count, label
+# [, decoder]) specs into fields that hold their mask, shift and
+# format strings. decode() gives one value's fields as a dict keyed by
+# label, decode_many() gives a whole array of values as one column per
+# field, using NumPy when it is installed. A label used by more than one
+# field (res0, ign) gets the field's low bit appended in those keys.
+# changes() lists only the fields that differ between two values.
+#
+
+import math
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Field():
+    def __init__(self, low_bit, bit_count, label, decoder=None):
+        self.low_bit = low_bit
+        self.bit_count = bit_count
+        self.label = label
+        self.decoder = decoder
+        self.mask = (1 << bit_count) - 1
+
+        if bit_count > 1:
+            bits = "[{}:{}]".format(low_bit + bit_count - 1, low_bit)
+        else:
+            bits = "[{}]".format(low_bit)
+        self.line_prefix = "{:<8}{:<8} 0b".format(bits, label)
+        self.binary = "{{:0{}b}}".format(bit_count)
+        self.short_prefix = label + ": "
+        self.short = "{{:#0{}_x}}".format(2 + math.ceil(bit_count / 4))
+
+    def extract(self, value):
+        return (value >> self.low_bit) & self.mask
+
+    def line(self, value):
+        field = (value >> self.low_bit) & self.mask
+        text = self.line_prefix + self.binary.format(field)
+        if self.decoder is not None:
+            text += "\t" + self.decoder.decode(field)
+        return text
+
+    def change(self, old, new):
+        old = (old >> self.low_bit) & self.mask
+        new = (new >> self.low_bit) & self.mask
+        text = self.line_prefix + self.binary.format(old) + " -> 0b" + self.binary.format(new)
+        if self.decoder is not None:
+            text += "\t{} -> {}".format(self.decoder.decode(old), self.decoder.decode(new))
+        return text
+
+    def format_short(self, value):
+        return self.short_prefix + self.short.format((value >> self.low_bit) & self.mask)
+
+class Layout():
+    def __init__(self, name, specs):
+        self.name = name
+        self.fields = tuple(Field(*spec) for spec in specs)
+
+        counts = Counter(field.label for field in self.fields)
+        self.keys = tuple(field.label if counts[field.label] == 1 else "{}_{}".format(field.label, field.low_bit)
+                          for field in self.fields)
+        self.by_label = {}
+        for field in self.fields:
+            self.by_label.setdefault(field.label, field)
+
+        if numpy is not None:
+            self.shifts = numpy.array([field.low_bit for field in self.fields], dtype=numpy.uint64)
+            self.masks = numpy.array([field.mask for field in self.fields], dtype=numpy.uint64)
+
+    def field(self, value, label):
+        # raises KeyError for a label the layout does not have
+        return self.by_label[label].extract(value)
+
+    def decode(self, value):
+        return {key: (value >> field.low_bit) & field.mask for key, field in zip(self.keys, self.fields)}
+
+    def decode_many(self, values):
+        # values are unsigned 64-bit; returns {key: column}
+        if numpy is not None:
+            values = numpy.asarray(values, dtype=numpy.uint64)
+            table = (values[:, None] >> self.shifts) & self.masks
+            return {key: table[:, i] for i, key in enumerate(self.keys)}
+        values = [int(value) for value in values]
+        return {key: [(value >> field.low_bit) & field.mask for value in values]
+                for key, field in zip(self.keys, self.fields)}
+
+    def lines(self, value):
+        return [field.line(value) for field in self.fields]
+
+    def changes(self, old, new):
+        # one line for each field that differs between two values
+        diff = old ^ new
+        return [field.change(old, new) for field in self.fields if (diff >> field.low_bit) & field.mask]
+
+    def summary(self, value, labels):
+        return ' '.join([field.format_short(value) for field in self.fields if field.label in labels])
+
+class TableShareabilityDecoder():
+    sharing = {
+        0b00: "Non-shareable",
+        0b01: "WARN: reserved value. Behavior is 'constrained unpredictable'",
+        0b10: "Outer shareable",
+        0b11: "Inner shareable"
+    }
+
+    def decode(self, sh):
+        return self.sharing[sh]
+
+SHAREABILITY = TableShareabilityDecoder()
+
+# System registers
+
+TCR_EL1 = Layout("TCR_EL1", ((61, 1, "MTX1"),
+                             (60, 1, "MTX0"),
+                             (59, 1, "DS"),
+                             (58, 1, "TCMA1"),
+                             (57, 1, "TCMA0"),
+                             (56, 1, "E0PD1"),
+                             (55, 1, "E0PD0"),
+                             (54, 1, "NFD1"),
+                             (53, 1, "NFD0"),
+                             (52, 1, "TBID1"),
+                             (51, 1, "TBID0"),
+                             (50, 1, "HWU162"),
+                             (49, 1, "HWU161"),
+                             (48, 1, "HWU160"),
+                             (47, 1, "HWU159"),
+                             (46, 1, "HWU062"),
+                             (45, 1, "HWU061"),
+                             (44, 1, "HWU060"),
+                             (43, 1, "HWU059"),
+                             (42, 1, "HPD1"),
+                             (41, 0, "HPD0"),
+                             (40, 1, "HD"),
+                             (39, 1, "HA"),
+                             (38, 1, "TBI1"),
+                             (37, 1, "TBI0"),
+                             (36, 1, "AS"),
+                             (32, 3, "IPS"),
+                             (30, 2, "TG1"),
+                             (28, 2, "SH1"),
+                             (26, 2, "ORGN1"),
+                             (24, 2, "IRGN1"),
+                             (23, 1, "EPD1"),
+                             (22, 1, "A1"),
+                             (16, 6, "T1SZ"),
+                             (14, 2, "TG0"),
+                             (12, 2, "SH0"),
+                             (10, 2, "ORGN0"),
+                             ( 8, 2, "IRGN0"),
+                             ( 7, 1, "EPD0"),
+                             ( 0, 6, "T0SZ")))
+
+HCR_EL2 = Layout("HCR_EL2", ((60, 3, "TWEDEL"),
+                             (59, 1, "TWEDEn"),
+                             (58, 1, "TID5"),
+                             (57, 1, "DCT"),
+                             (56, 1, "ATA"),
+                             (55, 1, "TTLBOS"),
+                             (54, 1, "TTLBIS"),
+                             (53, 1, "EnSCXT"),
+                             (52, 1, "TOCU"),
+                             (51, 1, "AMVOFFEN"),
+                             (50, 1, "TICAB"),
+                             (49, 1, "TID4"),
+                             (48, 1, "GPF"),
+                             (47, 1, "FIEN"),
+                             (46, 1, "FWB"),
+                             (45, 1, "NV2"),
+                             (44, 1, "AT"),
+                             (42, 1, "NV1"),
+                             (41, 1, "API"),
+                             (40, 1, "APK"),
+                             (39, 1, "TME"),
+                             (38, 1, "MIOCNCE"),
+                             (37, 1, "TEA"),
+                             (36, 1, "TERR"),
+                             (35, 1, "TLOR"),
+                             (34, 1, "E2H"),
+                             (33, 1, "ID"),
+                             (32, 1, "CD"),
+                             (31, 1, "RW"),
+                             (30, 1, "TRVM"),
+                             (29, 1, "HCR"),
+                             (28, 1, "TDZ"),
+                             (27, 1, "TGE"),
+                             (26, 1, "TVM"),
+                             (25, 1, "TTLB"),
+                             (24, 1, "TPU"),
+                             (23, 1, "Bit[23]"),
+                             (22, 1, "TSW"),
+                             (21, 1, "TACR"),
+                             (20, 1, "TIDCP"),
+                             (19, 1, "TSC"),
+                             (18, 1, "TID3"),
+                             (17, 1, "TID2"),
+                             (16, 1, "TID1"),
+                             (15, 1, "TID0"),
+                             (14, 1, "TWE"),
+                             (13, 1, "TWI"),
+                             (12, 1, "DC"),
+                             (10, 2, "BSU"),
+                             ( 9, 1, "FB"),
+                             ( 8, 1, "VSE"),
+                             ( 7, 1, "VI"),
+                             ( 6, 1, "VF"),
+                             ( 5, 1, "AMO"),
+                             ( 4, 1, "IMO"),
+                             ( 3, 1, "FMO"),
+                             ( 2, 1, "PTW"),
+                             ( 1, 1, "SWIO"),
+                             ( 0, 1, "VM")))
+
+SCTLR_EL1 = Layout("SCTLR_EL1", ((63, 1, "TIDCP"),
+                                 (62, 1, "SPINTMASK"),
+                                 (61, 1, "NMI"),
+                                 (60, 1, "EnTP2"),
+                                 (58, 2, "res0"),
+                                 (57, 1, "EPAN"),
+                                 (56, 1, "EnALS"),
+                                 (55, 1, "EnAS0"),
+                                 (54, 1, "EnASR"),
+                                 (53, 1, "TME"),
+                                 (52, 1, "TME0"),
+                                 (51, 1, "TMT"),
+                                 (50, 1, "TMT0"),
+                                 (46, 4, "TWEDEL"),
+                                 (45, 1, "TWEDEn"),
+                                 (44, 1, "DSSBS"),
+                                 (43, 1, "ATA"),
+                                 (42, 1, "ATA0"),
+                                 (40, 2, "TCF"),
+                                 (38, 2, "TCF0"),
+                                 (37, 1, "ITFSB"),
+                                 (36, 1, "BT1"),
+                                 (35, 1, "BT0"),
+                                 (34, 1, "res0"),
+                                 (33, 1, "MSCEn"),
+                                 (32, 1, "CMOW"),
+                                 (31, 1, "EnIA"),
+                                 (30, 1, "EnIB"),
+                                 (29, 1, "LSMAOE"),
+                                 (28, 1, "nTLSMD"),
+                                 (27, 1, "EnDA"),
+                                 (26, 1, "UCI"),
+                                 (25, 1, "EE"),
+                                 (24, 1, "E0E"),
+                                 (23, 1, "SPAN"),
+                                 (22, 1, "EIS"),
+                                 (21, 1, "IESB"),
+                                 (20, 1, "TSCXT"),
+                                 (19, 1, "WXN"),
+                                 (18, 1, "nTWE"),
+                                 (17, 1, "res0"),
+                                 (16, 1, "nTWI"),
+                                 (15, 1, "UCT"),
+                                 (14, 1, "DZE"),
+                                 (13, 1, "EnDB"),
+                                 (12, 1, "I"),
+                                 (11, 1, "EOS"),
+                                 (10, 1, "EnRCTX"),
+                                 ( 9, 1, "UMA"),
+                                 ( 8, 1, "SED"),
+                                 ( 7, 1, "ITD"),
+                                 ( 6, 1, "nAA"),
+                                 ( 5, 1, "CP15BEN"),
+                                 ( 4, 1, "SA0"),
+                                 ( 3, 1, "SA"),
+                                 ( 2, 1, "C"),
+                                 ( 1, 1, "A"),
+                                 ( 0, 1, "M")))
+CURRENT_EL = Layout("CurrentEL", ((2, 2, "EL"),))
+
+# Exception syndrome
+
+ESR_EL1 = Layout("ESR_EL1", ((32, 24, "ISS2"),
+                             (26,  6, "EC"),
+                             (25,  1, "IL"),
+                             ( 0, 24, "ISS")))
+
+DATA_ABORT_ISS = Layout("Data abort ISS", ((24, 1, "ISV"),
+                                           (22, 2, "SAS"),
+                                           (21, 1, "SSE"),
+                                           (16, 5, "SRT"),
+                                           (15, 1, "SF"),
+                                           (14, 1, "AR"),
+                                           (13, 1, "VNCR"),
+                                           (10, 1, "FNV"),
+                                           ( 9, 1, "EA"),
+                                           ( 8, 1, "CM"),
+                                           ( 7, 1, "S1ptw"),
+                                           ( 6, 1, "WNR"),
+                                           ( 0, 6, "DFSC")))
+
+INSTRUCTION_ABORT_ISS = Layout("Instruction abort ISS", ((14, 1, "PFV"),
+                                                         (11, 2, "SET"),
+                                                         (10, 1, "FnV"),
+                                                         ( 9, 1, "EA"),
+                                                         ( 7, 1, "S1ptw"),
+                                                         ( 0, 6, "IFSC")))
+
+EXCEPTION_CLASSES = {
+    0b000001: "Trapped WF*",
+    0b000011: "Trapped MCR or MRC",
+    0b000100: "Trapped MCRR or MRRC",
+    0b000101: "Trapped MCR or MRC",
+    0b000110: "Trapped LDC or STC",
+    0b000111: "Trapped SIMD",
+    0b001000: "Trapped VMRS",
+    0b001001: "Trapped pointer authentication",
+    0b001010: "Trapped LD64B or ST64B*",
+    0b001100: "Trapped MRRC",
+    0b001101: "Branch target exception",
+    0b001110: "Illegal execution state",
+    0b010001: "SVC instruction",
+    0b010010: "HVC instruction",
+    0b010011: "SMC instruction",
+    0b010101: "SVC instruction",
+    0b010110: "HVC instruction",
+    0b010111: "SMC instruction",
+    0b011000: "Trapped MRS, MSR, or system instruction",
+    0b011001: "Trapped SVE",
+    0b011010: "Trapped ERET",
+    0b011100: "Failed pointer authentication",
+    0b100000: "Instruction abort from lower level",
+    0b100001: "Instruction abort from same level",
+    0b100010: "PC alignment failure",
+    0b100100: "Data abort from lower level",
+    0b100101: "Data abort from same level",
+    0b100110: "SP alignment fault",
+    0b101000: "32-bit floating point exception",
+    0b101100: "64-bit floating point exception",
+    0b101111: "SError interrupt",
+    0b110000: "Breakpoint from lower level",
+    0b110001: "Breakpoint from same level",
+    0b110010: "Software step from lower level",
+    0b110011: "Software step from same level",
+    0b110100: "Watch point from same level",
+    0b110101: "Watch point from lower level",
+    0b111000: "Breakpoint in aarch32 mode",
+    0b1110101: "Vector catch in aarch32",
+    0b111100: "BRK instruction in aarch64",
+}
+
+DATA_ABORT_FSC = {
+    0b000000: "Address size fault, level 0 of translation or translation table base register",
+    0b000001: "Address size fault, level 1",
+    0b000010: "Address size fault, level 2",
+    0b000011: "Address size fault, level 3",
+    0b000100: "Translation fault, level 0",
+    0b000101: "Translation fault, level 1",
+    0b000110: "Translation fault, level 2",
+    0b000111: "Translation fault, level 3",
+    0b001001: "Access flag fault, level 1",
+    0b001010: "Access flag fault, level 2",
+    0b001011: "Access flag fault, level 3",
+    0b001000: "Access flag fault, level 0",
+    0b001100: "Permission fault, level 0",
+    0b001101: "Permission fault, level 1",
+    0b001110: "Permission fault, level 2",
+    0b001111: "Permission fault, level 3",
+    0b010000: "Synchronous External abort, not on TT walk or hardware update of translation table",
+    0b010001: "Synchronous Tag Check Fault",
+    0b010011: "Synchronous External abort on TT walk or hardware update of translation table, level -1",
+    0b010100: "Synchronous External abort on TT walk or hardware update of translation table, level 0",
+    0b010101: "Synchronous External abort on TT walk or hardware update of translation table, level 1",
+    0b010110: "Synchronous External abort on TT walk or hardware update of translation table, level 2",
+    0b010111: "Synchronous External abort on TT walk or hardware update of translation table, level 3",
+    0b011000: "Synchronous parity or ECC error on memory access, not on TT walk",
+    0b011011: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level -1",
+    0b011100: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 0",
+    0b011101: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 1",
+    0b011110: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 2",
+    0b011111: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 3",
+    0b100001: "Alignment fault",
+    0b100011: "Granule Protection Fault on TT walk or hardware update of translation table, level -1",
+    0b100100: "Granule Protection Fault on TT walk or hardware update of translation table, level 0",
+    0b100101: "Granule Protection Fault on TT walk or hardware update of translation table, level 1",
+    0b100110: "Granule Protection Fault on TT walk or hardware update of translation table, level 2",
+    0b100111: "Granule Protection Fault on TT walk or hardware update of translation table, level 3",
+    0b101000: "Granule Protection Fault, not on TT walk or hardware update of translation table",
+    0b101001: "Address size fault, level -1",
+    0b101011: "Translation fault, level -1",
+    0b110000: "TLB conflict abort",
+    0b110001: "Unsupported atomic hardware update fault",
+    0b110100: "IMPLEMENTATION DEFINED fault (Lockdown)",
+    0b110101: "IMPLEMENTATION DEFINED fault (Unsupported Exclusive or Atomic access)",
+}
+
+INSTRUCTION_ABORT_FSC = {
+    0b000000: "Address size fault, level 0 of translation or TTBR",
+    0b000001: "Address size fault, level 1",
+    0b000010: "Address size fault, level 2",
+    0b000011: "Address size fault, level 3",
+    0b000100: "Translation fault, level 0",
+    0b000101: "Translation fault, level 1",
+    0b000110: "Translation fault, level 2",
+    0b000111: "Translation fault, level 3",
+    0b001000: "Access flag fault, level 0",
+    0b001001: "Access flag fault, level 1",
+    0b001010: "Access flag fault, level 2",
+    0b001011: "Access flag fault, level 3",
+    0b001100: "Permission fault, level 0",
+    0b001101: "Permission fault, level 1",
+    0b001110: "Permission fault, level 2",
+    0b001111: "Permission fault, level 3",
+    0b010000: "Synchronous external abort, not on TT walk",
+    0b010010: "Synchronous external abort on TT walk, level -2",
+    0b010011: "Synchronous external abort on TT walk, level -1",
+    0b010100: "Synchronous external abort on TT walk, level 0",
+    0b010101: "Synchronous external abort on TT walk, level 1",
+    0b010110: "Synchronous external abort on TT walk, level 2",
+    0b010111: "Synchronous external abort on TT walk, level 3",
+    0b011000: "Synchronous parity or ECC error on memory access, not on TT walk",
+    0b011011: "Synchronous parity or ECC error on memory access, on TT walk, level -1",
+    0b011100: "Synchronous parity or ECC error on memory access, on TT walk, level 0",
+    0b011101: "Synchronous parity or ECC error on memory access, on TT walk, level 1",
+    0b011110: "Synchronous parity or ECC error on memory access, on TT walk, level 2",
+    0b011111: "Synchronous parity or ECC error on memory access, on TT walk, level 3",
+    0b101000: "Granule protection fault, not on TT walk",
+    0b100010: "Granule protection fault on TT walk, level -2",
+    0b100011: "Granule protection fault on TT walk, level -1",
+    0b100100: "Granule protection fault on TT walk, level 0",
+    0b100101: "Granule protection fault on TT walk, level 1",
+    0b100110: "Granule protection fault on TT walk, level 2",
+    0b100111: "Granule protection fault on TT walk, level 3",
+    0b101001: "Address size fault, level -1",
+    0b101010: "Translation fault, level -2",
+    0b101011: "Translation fault, level -1",
+    0b101100: "Address size fault, level -2",
+    0b110000: "TLB conflict abort",
+    0b110001: "Unsupported atomic hardware update fault",
+}
+
+# exception classes whose ISS ends in a fault status code
+FAULT_STATUS_CODES = {
+    0b100000: INSTRUCTION_ABORT_FSC,
+    0b100001: INSTRUCTION_ABORT_FSC,
+    0b100100: DATA_ABORT_FSC,
+    0b100101: DATA_ABORT_FSC,
+}
+
+def decode_syndrome(esr):
+    # (EC, fault status code or None, EC text, fault status text)
+    ec = (esr >> 26) & 0x3f
+    ec_text = EXCEPTION_CLASSES.get(ec, "EC 0b{:06b}".format(ec))
+    if ec not in FAULT_STATUS_CODES:
+        return ec, None, ec_text, ""
+    fsc = esr & 0x3f
+    return ec, fsc, ec_text, FAULT_STATUS_CODES[ec].get(fsc, "FSC 0b{:06b}".format(fsc))
+
+# Translation table descriptors (48 bit OA, 4K granule)
+
+TABLE_DESCRIPTOR = Layout("Table descriptor", (( 0,  1, "valid"),
+                                               ( 1,  1, "type"),
+                                               ( 2,  9, "ign"),
+                                               (12, 36, "next"),
+                                               (48,  2, "res0"),
+                                               (51,  7, "ign"),
+                                               (59,  1, "PXN"),
+                                               (60,  1, "UXN"),
+                                               (61,  2, "AP"),
+                                               (63,  1, "NS")))
+
+BLOCK_DESCRIPTOR = Layout("Block descriptor", (( 0,  1, "valid"),
+                                               ( 1,  1, "type"),
+                                               ( 2,  2, "MAIR idx"),
+                                               ( 5,  1, "NS"),
+                                               ( 6,  2, "AP"),
+                                               ( 8,  2, "SH", SHAREABILITY),
+                                               (10,  1, "AF"),
+                                               (11,  1, "NSE/nG"),
+                                               (12,  3, "unused"),
+                                               (16,  1, "nT"),
+                                               (21, 27, "OA"),
+                                               (48,  2, "res0"),
+                                               (50,  1, "GP"),
+                                               (51,  1, "DBM"),
+                                               (52,  1, "Contig"),
+                                               (53,  1, "PXN"),
+                                               (54,  1, "UXN/XN"),
+                                               (55,  3, "ignored"),
+                                               (59,  4, "PBHA"),
+                                               (63,  1, "ignored")))
+
+PAGE_DESCRIPTOR = Layout("Page descriptor", (( 0,  1, "valid"),
+                                             ( 1,  1, "type"),
+                                             ( 2,  2, "MAIR idx"),
+                                             ( 5,  1, "NS"),
+                                             ( 6,  2, "AP"),
+                                             ( 8,  2, "SH", SHAREABILITY),
+                                             (10,  1, "AF"),
+                                             (11,  1, "NSE/nG"),
+                                             (12,  3, "unused"),
+                                             (16,  1, "nT"),
+                                             (12, 36, "OA"),
+                                             (48,  2, "res0"),
+                                             (50,  1, "GP"),
+                                             (51,  1, "DBM"),
+                                             (52,  1, "Contig"),
+                                             (53,  1, "PXN"),
+                                             (54,  1, "UXN/XN"),
+                                             (55,  3, "ignored"),
+                                             (59,  4, "PBHA"),
+                                             (63,  1, "ignored")))
+
+# layouts of the registers read by name
+REGISTERS = {layout.name: layout for layout in (TCR_EL1, HCR_EL2, SCTLR_EL1, CURRENT_EL, ESR_EL1)}
@@ -6,289 +6,124 @@
 #   armv8a-exception - Displays exception class and ISR data
 #   armv8a-tcr-el1   - Displays register value and fields
 #   armv8a-hcr-el2   - Displays register value and fields
+#   mmap [-v] [reg]  - Displays the memory map under TTBR0_EL1 (or reg)
+#                      as merged VA -> PA ranges. With -v, also lists
+#                      every valid descriptor. reg may also be the
+#                      address of a level 0 table, which is how to walk
+#                      the tables in a memory-dump-file.
+#   vtop addr [reg]  - Translates a virtual address through TTBR0_EL1 or
+#                      TTBR1_EL1 (picked from the address unless reg is
+#                      given), using the granule and sizes in TCR_EL1
+#   allcores [cmd]   - Shows PC, SP and the exception and MMU registers of
+#                      every core side by side, or runs cmd on each core
+#   trace-exceptions on [size] | off | clear | show [n] | summary
+#                    - Logs every exception taken through the vector
+#                      table in src/exceptions.S without stopping the
+#                      target, keeping the last size (default 4096),
+#                      then lists the last n decoded, or counts them by
+#                      exception class, fault status and ELR
+#   sysregs [-a | -q | reset]
+#                    - Reads the registers in sysregs-registers and shows
+#                      the ones that changed since the last sysregs on
+#                      this thread, decoded field by field. -a also lists
+#                      the unchanged ones, -q prints nothing when nothing
+#                      changed, reset forgets the previous values
+#
+# Registers are read once per thread and kept until the next stop, so
+# running several of these commands, or one of them on every core,
+# costs no more round trips than the first.
+#
+# The register and descriptor layouts live in bitfields.py, which does
+# not need gdb, so the same decoders can be used on logged values
+# outside the debugger.
 #
 # Settings:
+#   sysregs-registers <names>
+#     The registers sysregs reads, separated by spaces. Defaults to
+#     CurrentEL, the EL1 MMU and exception registers and HCR_EL2.
+#   sysregs-on-stop <bool>
+#     When true, "sysregs -q" runs on every stop. Defaults to false.
 #
 
-import math
+import os
+import sys
+import time
+from array import array
+from collections import Counter, deque, namedtuple
 import gdb
 
-def print_bits(value, bitfield):
-    if len(bitfield) == 4:
-        low_bit, bit_count, label, decoder = bitfield
-    else:
-        low_bit, bit_count, label = bitfield
-        decoder = None
-    field = (value >> low_bit) & ((1 << bit_count) - 1)
-    if bit_count > 1:
-        bitfield = "[{}:{}]".format(low_bit + bit_count - 1, low_bit)
-    else:
-        bitfield = "[{}]".format(low_bit)
-    padded_binary = "{:0{}b}".format(field, bit_count)
-    if decoder is None:
-        print("{:<8}{:<8} 0b{}".format(bitfield, label, padded_binary))
-    else:
-        print("{:<8}{:<8} 0b{}\t{}".format(bitfield, label, padded_binary, decoder.decode(field)))
-
-def print_bitfields(value, bitfields):
-    [print_bits(value, x) for x in bitfields]
-
-def print_bits_short(value, bitfield):
-    if len(bitfield) == 4:
-        low_bit, bit_count, label, decoder = bitfield
-    else:
-        low_bit, bit_count, label = bitfield
-        decoder = None
-    field = (value >> low_bit) & ((1 << bit_count) - 1)
-    hex_digits = math.ceil(bit_count/4)
-    print(f'{label}: {field:#0{2+hex_digits}_x}', end=' ')
-
-def print_bitfields_short(value, bitfields, summary_fields):
-    [print_bits_short(value, x) for x in bitfields if x[2] in summary_fields]
-
-class Armv8ARegister(gdb.Command):
-    def __init__(self, cmd, reg, label, bitfields):
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bitfields
+import memory
+import stats
+import symbols
+
+def print_bitfields(value, layout):
+    print('\n'.join(layout.lines(value)))
+
+def format_bitfields_short(value, layout, summary_fields):
+    return layout.summary(value, summary_fields)
+
+def print_bitfields_short(value, layout, summary_fields):
+    print(layout.summary(value, summary_fields), end=' ')
+
+REGISTER_MASK = 0xffffffffffffffff
+
+class RegisterCache():
+    def __init__(self):
+        self.values = {}
+
+    def invalidate(self, event=None):
+        self.values.clear()
+
+    def read(self, reg):
+        # raises ValueError (or gdb.error) for a register the target
+        # does not have; that is not kept
+        key = (gdb.selected_thread().global_num, reg)
+        if key not in self.values:
+            self.values[key] = int(stats.read_register(gdb.newest_frame(), reg)) & REGISTER_MASK
+        return self.values[key]
+
+registers = RegisterCache()
+
+class Armv8ARegister(stats.Command):
+    def __init__(self, cmd, reg, label, layout):
         super (Armv8ARegister, self).__init__(cmd, gdb.COMMAND_DATA)
         self.reg = reg
         self.label = label
-        self.bitfields = bitfields
+        self.layout = layout
 
     def invoke(self, arg, from_tty):
-        frame = gdb.selected_frame()
-        value = int(frame.read_register(self.reg))
+        value = registers.read(self.reg)
         print("{}: 0x{:08x}".format(self.label, value))
-        print_bitfields(value, self.bitfields)
+        print_bitfields(value, self.layout)
 
 Armv8ARegister("armv8a-tcr-el1",
                "TCR_EL1",
                "Translation Control Register EL1",
-               ((61, 1, "MTX1"),
-                (60, 1, "MTX0"),
-                (59, 1, "DS"),
-                (58, 1, "TCMA1"),
-                (57, 1, "TCMA0"),
-                (56, 1, "E0PD1"),
-                (55, 1, "E0PD0"),
-                (54, 1, "NFD1"),
-                (53, 1, "NFD0"),
-                (52, 1, "TBID1"),
-                (51, 1, "TBID0"),
-                (50, 1, "HWU162"),
-                (49, 1, "HWU161"),
-                (48, 1, "HWU160"),
-                (47, 1, "HWU159"),
-                (46, 1, "HWU062"),
-                (45, 1, "HWU061"),
-                (44, 1, "HWU060"),
-                (43, 1, "HWU059"),
-                (42, 1, "HPD1"),
-                (41, 0, "HPD0"),
-                (40, 1, "HD"),
-                (39, 1, "HA"),
-                (38, 1, "TBI1"),
-                (37, 1, "TBI0"),
-                (36, 1, "AS"),
-                (32, 3, "IPS"),
-                (30, 2, "TG1"),
-                (28, 2, "SH1"),
-                (26, 2, "ORGN1"),
-                (24, 2, "IRGN1"),
-                (23, 1, "EPD1"),
-                (22, 1, "A1"),
-                (16, 6, "T1SZ"),
-                (14, 2, "TG0"),
-                (12, 2, "SH0"),
-                (10, 2, "ORGN0"),
-                ( 8, 2, "IRGN0"),
-                ( 7, 1, "EPD0"),
-                ( 0, 6, "T0SZ")))
+               bitfields.TCR_EL1)
 
 Armv8ARegister("armv8a-hcr-el2",
                "HCR_EL2",
                "Hypervisor Control Register EL2",
-               ((60, 3, "TWEDEL"),
-                (59, 1, "TWEDEn"),
-                (58, 1, "TID5"),
-                (57, 1, "DCT"),
-                (56, 1, "ATA"),
-                (55, 1, "TTLBOS"),
-                (54, 1, "TTLBIS"),
-                (53, 1, "EnSCXT"),
-                (52, 1, "TOCU"),
-                (51, 1, "AMVOFFEN"),
-                (50, 1, "TICAB"),
-                (49, 1, "TID4"),
-                (48, 1, "GPF"),
-                (47, 1, "FIEN"),
-                (46, 1, "FWB"),
-                (45, 1, "NV2"),
-                (44, 1, "AT"),
-                (42, 1, "NV1"),
-                (41, 1, "API"),
-                (40, 1, "APK"),
-                (39, 1, "TME"),
-                (38, 1, "MIOCNCE"),
-                (37, 1, "TEA"),
-                (36, 1, "TERR"),
-                (35, 1, "TLOR"),
-                (34, 1, "E2H"),
-                (33, 1, "ID"),
-                (32, 1, "CD"),
-                (31, 1, "RW"),
-                (30, 1, "TRVM"),
-                (29, 1, "HCR"),
-                (28, 1, "TDZ"),
-                (27, 1, "TGE"),
-                (26, 1, "TVM"),
-                (25, 1, "TTLB"),
-                (24, 1, "TPU"),
-                (23, 1, "Bit[23]"),
-                (22, 1, "TSW"),
-                (21, 1, "TACR"),
-                (20, 1, "TIDCP"),
-                (19, 1, "TSC"),
-                (18, 1, "TID3"),
-                (17, 1, "TID2"),
-                (16, 1, "TID1"),
-                (15, 1, "TID0"),
-                (14, 1, "TWE"),
-                (13, 1, "TWI"),
-                (12, 1, "DC"),
-                (10, 2, "BSU"),
-                ( 9, 1, "FB"),
-                ( 8, 1, "VSE"),
-                ( 7, 1, "VI"),
-                ( 6, 1, "VF"),
-                ( 5, 1, "AMO"),
-                ( 4, 1, "IMO"),
-                ( 3, 1, "FMO"),
-                ( 2, 1, "PTW"),
-                ( 1, 1, "SWIO"),
-                ( 0, 1, "VM")))
+               bitfields.HCR_EL2)
 
 Armv8ARegister("armv8a-sctlr-el1",
                "SCTLR_EL1",
                "System Control Register EL1",
-               ((63, 1, "TIDCP"),
-                (62, 1, "SPINTMASK"),
-                (61, 1, "NMI"),
-                (60, 1, "EnTP2"),
-                (58, 2, "res0"),
-                (57, 1, "EPAN"),
-                (56, 1, "EnALS"),
-                (55, 1, "EnAS0"),
-                (54, 1, "EnASR"),
-                (53, 1, "TME"),
-                (52, 1, "TME0"),
-                (51, 1, "TMT"),
-                (50, 1, "TMT0"),
-                (46, 4, "TWEDEL"),
-                (45, 1, "TWEDEn"),
-                (44, 1, "DSSBS"),
-                (43, 1, "ATA"),
-                (42, 1, "ATA0"),
-                (40, 2, "TCF"),
-                (38, 2, "TCF0"),
-                (37, 1, "ITFSB"),
-                (36, 1, "BT1"),
-                (35, 1, "BT0"),
-                (34, 1, "res0"),
-                (33, 1, "MSCEn"),
-                (32, 1, "CMOW"),
-                (31, 1, "EnIA"),
-                (30, 1, "EnIB"),
-                (29, 1, "LSMAOE"),
-                (28, 1, "nTLSMD"),
-                (27, 1, "EnDA"),
-                (26, 1, "UCI"),
-                (25, 1, "EE"),
-                (24, 1, "E0E"),
-                (23, 1, "SPAN"),
-                (22, 1, "EIS"),
-                (21, 1, "IESB"),
-                (20, 1, "TSCXT"),
-                (19, 1, "WXN"),
-                (18, 1, "nTWE"),
-                (17, 1, "res0"),
-                (16, 1, "nTWI"),
-                (15, 1, "UCT"),
-                (14, 1, "DZE"),
-                (13, 1, "EnDB"),
-                (12, 1, "I"),
-                (11, 1, "EOS"),
-                (10, 1, "EnRCTX"),
-                ( 9, 1, "UMA"),
-                ( 8, 1, "SED"),
-                ( 7, 1, "ITD"),
-                ( 6, 1, "nAA"),
-                ( 5, 1, "CP15BEN"),
-                ( 4, 1, "SA0"),
-                ( 3, 1, "SA"),
-                ( 2, 1, "C"),
-                ( 1, 1, "A"),
-                ( 0, 1, "M")))
+               bitfields.SCTLR_EL1)
 
 class DataAbortDecode():
-    data_abort_dfsc = {
-        0b000000: "Address size fault, level 0 of translation or translation table base register",
-        0b000001: "Address size fault, level 1",
-        0b000010: "Address size fault, level 2",
-        0b000011: "Address size fault, level 3",
-        0b000100: "Translation fault, level 0",
-        0b000101: "Translation fault, level 1",
-        0b000110: "Translation fault, level 2",
-        0b000111: "Translation fault, level 3",
-        0b001001: "Access flag fault, level 1",
-        0b001010: "Access flag fault, level 2",
-        0b001011: "Access flag fault, level 3",
-        0b001000: "Access flag fault, level 0",
-        0b001100: "Permission fault, level 0",
-        0b001101: "Permission fault, level 1",
-        0b001110: "Permission fault, level 2",
-        0b001111: "Permission fault, level 3",
-        0b010000: "Synchronous External abort, not on TT walk or hardware update of translation table",
-        0b010001: "Synchronous Tag Check Fault",
-        0b010011: "Synchronous External abort on TT walk or hardware update of translation table, level -1",
-        0b010100: "Synchronous External abort on TT walk or hardware update of translation table, level 0",
-        0b010101: "Synchronous External abort on TT walk or hardware update of translation table, level 1",
-        0b010110: "Synchronous External abort on TT walk or hardware update of translation table, level 2",
-        0b010111: "Synchronous External abort on TT walk or hardware update of translation table, level 3",
-        0b011000: "Synchronous parity or ECC error on memory access, not on TT walk",
-        0b011011: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level -1",
-        0b011100: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 0",
-        0b011101: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 1",
-        0b011110: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 2",
-        0b011111: "Synchronous parity or ECC error on memory access on TT walk or hardware update of translation table, level 3",
-        0b100001: "Alignment fault",
-        0b100011: "Granule Protection Fault on TT walk or hardware update of translation table, level -1",
-        0b100100: "Granule Protection Fault on TT walk or hardware update of translation table, level 0",
-        0b100101: "Granule Protection Fault on TT walk or hardware update of translation table, level 1",
-        0b100110: "Granule Protection Fault on TT walk or hardware update of translation table, level 2",
-        0b100111: "Granule Protection Fault on TT walk or hardware update of translation table, level 3",
-        0b101000: "Granule Protection Fault, not on TT walk or hardware update of translation table",
-        0b101001: "Address size fault, level -1",
-        0b101011: "Translation fault, level -1",
-        0b110000: "TLB conflict abort",
-        0b110001: "Unsupported atomic hardware update fault",
-        0b110100: "IMPLEMENTATION DEFINED fault (Lockdown)",
-        0b110101: "IMPLEMENTATION DEFINED fault (Unsupported Exclusive or Atomic access)",
-    }
-    bitfields = ((24, 1, "ISV"),
-                 (22, 2, "SAS"),
-                 (21, 1, "SSE"),
-                 (16, 5, "SRT"),
-                 (15, 1, "SF"),
-                 (14, 1, "AR"),
-                 (13, 1, "VNCR"),
-                 (10, 1, "FNV"),
-                 ( 9, 1, "EA"),
-                 ( 8, 1, "CM"),
-                 ( 7, 1, "S1ptw"),
-                 ( 6, 1, "WNR"),
-                 ( 0, 6, "DFSC"))
-
-    def decode_iss(self, frame, iss):
-        print_bitfields(iss, self.bitfields)
+    data_abort_dfsc = bitfields.DATA_ABORT_FSC
+    layout = bitfields.DATA_ABORT_ISS
+
+    def decode_iss(self, iss):
+        print_bitfields(iss, self.layout)
         isv = (iss >> 23) & 0x1
         if isv:
             sas = (iss >> 22) & 0x3
@@ -303,73 +138,21 @@ class DataAbortDecode():
             print("Register: ", hex(srt), "64-bit" if sf else "32-bit")
         fnv = (iss >> 9) & 0x1
         if not fnv:
-            value = int(frame.read_register("FAR_EL1"))
-            if (value < 0):
-                print("        FAR      {:08x}".format(value + (1 << 64)))
-            else:
-                print("        FAR      {:08x}".format(value))
+            value = registers.read("FAR_EL1")
+            print("        FAR      {:08x}".format(value))
         dfsc = iss & 0x3f
         if dfsc in self.data_abort_dfsc:
             print("                ", self.data_abort_dfsc[dfsc])
 
 class InstructionAbortDecode():
-    instruction_abort_ifsc = {
-        0b000000: "Address size fault, level 0 of translation or TTBR",
-        0b000001: "Address size fault, level 1",
-        0b000010: "Address size fault, level 2",
-        0b000011: "Address size fault, level 3",
-        0b000100: "Translation fault, level 0",
-        0b000101: "Translation fault, level 1",
-        0b000110: "Translation fault, level 2",
-        0b000111: "Translation fault, level 3",
-        0b001000: "Access flag fault, level 0",
-        0b001001: "Access flag fault, level 1",
-        0b001010: "Access flag fault, level 2",
-        0b001011: "Access flag fault, level 3",
-        0b001100: "Permission fault, level 0",
-        0b001101: "Permission fault, level 1",
-        0b001110: "Permission fault, level 2",
-        0b001111: "Permission fault, level 3",
-        0b010000: "Synchronous external abort, not on TT walk",
-        0b010010: "Synchronous external abort on TT walk, level -2",
-        0b010011: "Synchronous external abort on TT walk, level -1",
-        0b010100: "Synchronous external abort on TT walk, level 0",
-        0b010101: "Synchronous external abort on TT walk, level 1",
-        0b010110: "Synchronous external abort on TT walk, level 2",
-        0b010111: "Synchronous external abort on TT walk, level 3",
-        0b011000: "Synchronous parity or ECC error on memory access, not on TT walk",
-        0b011011: "Synchronous parity or ECC error on memory access, on TT walk, level -1",
-        0b011100: "Synchronous parity or ECC error on memory access, on TT walk, level 0",
-        0b011101: "Synchronous parity or ECC error on memory access, on TT walk, level 1",
-        0b011110: "Synchronous parity or ECC error on memory access, on TT walk, level 2",
-        0b011111: "Synchronous parity or ECC error on memory access, on TT walk, level 3",
-        0b101000: "Granule protection fault, not on TT walk",
-        0b100010: "Granule protection fault on TT walk, level -2",
-        0b100011: "Granule protection fault on TT walk, level -1",
-        0b100100: "Granule protection fault on TT walk, level 0",
-        0b100101: "Granule protection fault on TT walk, level 1",
-        0b100110: "Granule protection fault on TT walk, level 2",
-        0b100111: "Granule protection fault on TT walk, level 3",
-        0b101001: "Address size fault, level -1",
-        0b101010: "Translation fault, level -2",
-        0b101011: "Translation fault, level -1",
-        0b101100: "Address size fault, level -2",
-        0b110000: "TLB conflict abort",
-        0b110001: "Unsupported atomic hardware update fault"
-    }
-
-    bitfields = ((14, 1, "PFV"),
-                 (11, 2, "SET"),
-                 (10, 1, "FnV"),
-                 ( 9, 1, "EA"),
-                 ( 7, 1, "S1ptw"),
-                 ( 0, 6, "IFSC"))
+    instruction_abort_ifsc = bitfields.INSTRUCTION_ABORT_FSC
+    layout = bitfields.INSTRUCTION_ABORT_ISS
 
-    def decode_iss(self, frame, iss):
-        print_bitfields(iss, self.bitfields)
+    def decode_iss(self, iss):
+        print_bitfields(iss, self.layout)
         fnv = (iss >> 9) & 0x1
         if not fnv:
-            value = int(frame.read_register("FAR_EL1"))
+            value = registers.read("FAR_EL1")
             print("        FAR      {:08x}".format(value))
         ifsc = iss & 0x3f
         if ifsc in self.instruction_abort_ifsc:
@@ -380,62 +163,17 @@ class Armv8AException(Armv8ARegister):
         super (Armv8AException, self).__init__ ("armv8a-exception",
                                                 "ESR_EL1",
                                                 "Exception Syndrome Register EL1",
-                                                ((32, 24, "ISS2"),
-                                                 (26,  6, "EC"),
-                                                 (25,  1, "IL"),
-                                                 ( 0, 24, "ISS")))
+                                                bitfields.ESR_EL1)
 
     decoders = {
         0b100101: DataAbortDecode(),
         0b100001: InstructionAbortDecode()
     }
 
-    error_codes = {
-        0b000001: "Trapped WF*",
-        0b000011: "Trapped MCR or MRC",
-        0b000100: "Trapped MCRR or MRRC",
-        0b000101: "Trapped MCR or MRC",
-        0b000110: "Trapped LDC or STC",
-        0b000111: "Trapped SIMD",
-        0b001000: "Trapped VMRS",
-        0b001001: "Trapped pointer authentication",
-        0b001010: "Trapped LD64B or ST64B*",
-        0b001100: "Trapped MRRC",
-        0b001101: "Branch target exception",
-        0b001110: "Illegal execution state",
-        0b010001: "SVC instruction",
-        0b010010: "HVC instruction",
-        0b010011: "SMC instruction",
-        0b010101: "SVC instruction",
-        0b010110: "HVC instruction",
-        0b010111: "SMC instruction",
-        0b011000: "Trapped MRS, MSR, or system instruction",
-        0b011001: "Trapped SVE",
-        0b011010: "Trapped ERET",
-        0b011100: "Failed pointer authentication",
-        0b100000: "Instruction abort from lower level",
-        0b100001: "Instruction abort from same level",
-        0b100010: "PC alignment failure",
-        0b100100: "Data abort from lower level",
-        0b100101: "Data abort from same level",
-        0b100110: "SP alignment fault",
-        0b101000: "32-bit floating point exception",
-        0b101100: "64-bit floating point exception",
-        0b101111: "SError interrupt",
-        0b110000: "Breakpoint from lower level",
-        0b110001: "Breakpoint from same level",
-        0b110010: "Software step from lower level",
-        0b110011: "Software step from same level",
-        0b110100: "Watch point from same level",
-        0b110101: "Watch point from lower level",
-        0b111000: "Breakpoint in aarch32 mode",
-        0b1110101: "Vector catch in aarch32",
-        0b111100: "BRK instruction in aarch64",
-    }
+    error_codes = bitfields.EXCEPTION_CLASSES
 
     def invoke(self, arg, from_tty):
-        frame = gdb.selected_frame()
-        value = int(frame.read_register("ESR_EL1"))
+        value = registers.read("ESR_EL1")
         if value == 0:
             print("No exception detected in ESR_EL1")
             return None
@@ -447,68 +185,24 @@ class Armv8AException(Armv8ARegister):
             print("                ", self.error_codes[ec])
         iss = value & 0xffffff
         if ec in self.decoders:
-            self.decoders[ec].decode_iss(frame, iss)
+            self.decoders[ec].decode_iss(iss)
 
 Armv8AException()
 
-class TableShareabilityDecoder():
-    sharing = {
-        0b00: "Non-shareable",
-        0b01: "WARN: reserved value. Behavior is 'constrained unpredictable'",
-        0b10: "Outer shareable",
-        0b11: "Inner shareable"
-    }
-
-    def decode(self, sh):
-        return self.sharing[sh]
-
-class Armv8ATableDescriptor(gdb.Command):
+class Armv8ATableDescriptor(stats.Command):
     def __init__(self):
         super (Armv8ATableDescriptor, self).__init__("ttable", gdb.COMMAND_DATA)
 
-    table_descriptor_bitfields = (
-        (0, 1, "valid"),
-        (1, 1, "type"),
-        (2, 9, "ign"),
-        (12, 36, "next"),
-        (48, 2, "res0"),
-        (51, 7, "ign"),
-        (59, 1, "PXN"),
-        (60, 1, "UXN"),
-        (61, 2, "AP"),
-        (63, 1, "NS"))
-
-    block_descriptor_bitfields = (
-        (0, 1, "valid"),
-        (1, 1, "type"),
-        (2, 2, "MAIR idx"),
-        (5, 1, "NS"),
-        (6, 2, "AP"),
-        (8, 2, "SH", TableShareabilityDecoder()),
-        (10, 1, "AF"),
-        (11, 1, "NSE/nG"),
-        (12, 3, "unused"),
-        (16, 1, "nT"),
-        (21, 27, "OA"),
-        (48, 2, "res0"),
-        (50, 1, "GP"),
-        (51, 1, "DBM"),
-        (52, 1, "Contig"),
-        (53, 1, "PXN"),
-        (54, 1, "UXN/XN"),
-        (55, 3, "ignored"),
-        (59, 4, "PBHA"),
-        (63, 1, "ignored"))
+    table_descriptor_bitfields = bitfields.TABLE_DESCRIPTOR
+    block_descriptor_bitfields = bitfields.BLOCK_DESCRIPTOR
 
     def invoke(self, arg, from_tty):
         argv = gdb.string_to_argv(arg)
-        addr = gdb.parse_and_eval(argv[0]).cast(gdb.lookup_type('long').pointer())
+        addr = symbols.parse_address(argv[0])
         self.decode_entry_at(addr)
 
     def decode_entry_at(self, addr):
-        inferior = gdb.selected_inferior()
-        table_entry = inferior.read_memory(addr, 8).cast('L')
-        value = table_entry[0]
+        value = memory.read_u64(addr)
 
         if value & 0b01:
             if value & 0b10:
@@ -525,7 +219,11 @@ class Armv8ATableDescriptor(gdb.Command):
     def summarize(self, addr, value, level):
         prefix = "L{}{}".format(level, "  "*level)
         if value & 0b01:
-            if value & 0b10:
+            if value & 0b10 and level == 3:
+                print("{}PAG: {:08x}".format(prefix, addr), end=' ')
+                print_bitfields_short(value, Armv8APageDescriptor.page_descriptor_bitfields, ["SH", "AF", "OA", "PXN", "UXN/XN", "MAIR idx"])
+                print()
+            elif value & 0b10:
                 print("{}TBL: {:08x}".format(prefix, addr), end=' ')
                 print_bitfields_short(value, self.table_descriptor_bitfields, ["next", "PXN", "UXN", "AP"])
                 print()
@@ -537,45 +235,23 @@ class Armv8ATableDescriptor(gdb.Command):
             print("{}INV: {:08x}".format(prefix, addr))
 
 
-Armv8ATableDescriptor()
+table_descriptor = Armv8ATableDescriptor()
+
 # Assumptions
 # - 48 bit OA
 # - 4K translation granule
-class Armv8APageDescriptor(gdb.Command):
+class Armv8APageDescriptor(stats.Command):
     def __init__(self):
         super (Armv8APageDescriptor, self).__init__("tpage", gdb.COMMAND_DATA)
 
-    page_descriptor_bitfields = (
-        (0, 1, "valid"),
-        (1, 1, "type"),
-        (2, 2, "MAIR idx"),
-        (5, 1, "NS"),
-        (6, 2, "AP"),
-        (8, 2, "SH", TableShareabilityDecoder()),
-        (10, 1, "AF"),
-        (11, 1, "NSE/nG"),
-        (12, 3, "unused"),
-        (16, 1, "nT"),
-        (12, 36, "OA"),
-        (48, 2, "res0"),
-        (50, 1, "GP"),
-        (51, 1, "DBM"),
-        (52, 1, "Contig"),
-        (53, 1, "PXN"),
-        (54, 1, "UXN/XN"),
-        (55, 3, "ignored"),
-        (59, 4, "PBHA"),
-        (63, 1, "ignored"))
+    page_descriptor_bitfields = bitfields.PAGE_DESCRIPTOR
 
     def invoke(self, arg, from_tty):
         argv = gdb.string_to_argv(arg)
 
-        addr = gdb.parse_and_eval(argv[0]).cast(gdb.lookup_type('long').pointer())
+        addr = symbols.parse_address(argv[0])
 
-        inferior = gdb.selected_inferior()
-
-        table_entry = inferior.read_memory(addr, 8).cast('L')
-        value = table_entry[0]
+        value = memory.read_u64(addr)
 
         if not (value & 0b10):
             print("Something seems wrong. Bit 1 should be set for a page descriptor.")
@@ -587,50 +263,581 @@ class Armv8APageDescriptor(gdb.Command):
 
 Armv8APageDescriptor()
 
-class Armv8AMemoryMap(gdb.Command):
+# Translation tables are read a whole 4K table at a time and decoded
+# in one pass.
+#
+# Assumptions
+# - 48 bit VA and OA
+# - 4K translation granule, so walks start at level 0
+TABLE_ENTRIES = 512
+TABLE_SIZE = 8 * TABLE_ENTRIES
+OA_MASK = 0x0000fffffffff000
+LEVEL_SHIFTS = (39, 30, 21, 12)
+
+# lower (11:2) and upper (63:50) attributes of block and page descriptors
+BLOCK_ATTR_MASK = 0xfffc000000000ffc
+# NSTable, APTable, UXNTable and PXNTable of table descriptors
+TABLE_ATTR_MASK = 0xf800000000000000
+
+def read_table(addr, size=TABLE_SIZE):
+    data = memory.read(addr, size)
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype='<u8')
+    entries = array('Q')
+    entries.frombytes(data)
+    if sys.byteorder != 'little':
+        entries.byteswap()
+    return entries
+
+def valid_entries(entries):
+    if numpy is not None:
+        indices = numpy.flatnonzero(entries & 1)
+        return zip(indices.tolist(), entries[indices].tolist())
+    return [(i, value) for i, value in enumerate(entries) if value & 1]
+
+def is_table_descriptor(value, level):
+    return level < 3 and value & 0b10
+
+def is_leaf_descriptor(value, level):
+    # blocks at levels 1 and 2, pages at level 3
+    if level == 3:
+        return value & 0b11 == 0b11
+    return level > 0 and value & 0b11 == 0b01
+
+def format_size(size):
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if size < 1024 or size % 1024:
+            return '{}{}'.format(size, unit)
+        size //= 1024
+    return '{}P'.format(size)
+
+class Armv8AMemoryMap(stats.Command):
     def __init__(self):
         super (Armv8AMemoryMap, self).__init__("mmap", gdb.COMMAND_DATA)
 
-    def get_entry(self, addr):
-        inferior = gdb.selected_inferior()
-        table_entry = inferior.read_memory(addr, 8).cast('L')
-        return table_entry[0]
-
-    def walk(self, table, level):
-        valid = True
-        index = 0
-        while index < 512 and valid:
-            # get descriptor
-            addr = table + (8*index)
-            entry = self.get_entry(addr)
-
-            # if this is a legit descriptor
-            valid = entry & 0b1 == 1
-
-            if valid:
-                # print summary
-                Armv8ATableDescriptor().summarize(addr, entry, level)
-                # if table descriptor
-                if level < 3 and (entry & 0b10 == 2):
-                    #   recursively call walk with target table, level
-                    #   + 1
-                    next_table = ((entry >> 12) & 0xfffffffff) << 12
-                    self.walk(next_table, level + 1)
-                index = index + 1
+    block_summary = ["MAIR idx", "AP", "SH", "AF", "PXN", "UXN/XN"]
+    table_summary = ["PXN", "UXN", "AP", "NS"]
+
+    def walk(self, table, level, va, inherited, ranges, verbose):
+        shift = LEVEL_SHIFTS[level]
+        for index, entry in valid_entries(read_table(table)):
+            entry_va = va | (index << shift)
+            if verbose:
+                table_descriptor.summarize(table + 8*index, entry, level)
+
+            if is_table_descriptor(entry, level):
+                self.walk(entry & OA_MASK, level + 1, entry_va,
+                          inherited | (entry & TABLE_ATTR_MASK), ranges, verbose)
+            elif is_leaf_descriptor(entry, level):
+                size = 1 << shift
+                pa = entry & OA_MASK & ~(size - 1)
+                attrs = (entry & BLOCK_ATTR_MASK, inherited)
+                self.add_range(ranges, entry_va, pa, size, attrs)
+
+    def add_range(self, ranges, va, pa, size, attrs):
+        # merge with the previous range when it continues it exactly
+        if ranges:
+            last = ranges[-1]
+            last_va, last_pa, last_size, last_attrs = last
+            if last_va + last_size == va and last_pa + last_size == pa and last_attrs == attrs:
+                last[2] = last_size + size
+                return
+        ranges.append([va, pa, size, attrs])
+
+    def print_range(self, va, pa, size, attrs):
+        block_attrs, table_attrs = attrs
+        print("0x{:016x}-0x{:016x} -> 0x{:012x} {:>6}".format(va, va + size - 1, pa, format_size(size)), end=' ')
+        print(format_bitfields_short(block_attrs, table_descriptor.block_descriptor_bitfields, self.block_summary), end='')
+        if table_attrs:
+            print(" table", format_bitfields_short(table_attrs, table_descriptor.table_descriptor_bitfields, self.table_summary), end='')
+        print()
 
     def invoke(self, arg, from_tty):
         argv = gdb.string_to_argv(arg)
 
+        verbose = '-v' in argv
+        argv = [a for a in argv if a != '-v']
+
         if len(argv) == 0:
             reg = "TTBR0_EL1"
         else:
             reg = argv[0]
 
-        frame = gdb.selected_frame()
-        ttbase = int(frame.read_register(reg))
+        try:
+            ttbase = registers.read(reg) & OA_MASK
+        except (ValueError, gdb.error):
+            # not a register (or no live target): a table address
+            ttbase = symbols.parse_address(reg) & OA_MASK
+
+        # TTBR1 covers the top of the address space
+        va = 0xffff000000000000 if reg.upper().startswith("TTBR1") else 0
 
         print("Translation table ({}): 0x{:08x}".format(reg, ttbase))
 
-        self.walk(ttbase, 0)
+        ranges = []
+        self.walk(ttbase, 0, va, 0, ranges, verbose)
+        for r in ranges:
+            self.print_range(*r)
 
 Armv8AMemoryMap()
+
+# TG0 and TG1 encode the granule differently
+TG0_GRANULES = {0b00: 12, 0b01: 16, 0b10: 14}
+TG1_GRANULES = {0b01: 14, 0b10: 12, 0b11: 16}
+
+Translation = namedtuple('Translation', ['va', 'pa', 'level', 'size', 'descriptor'])
+
+class TranslationFault(Exception):
+    def __init__(self, level, descriptor):
+        super().__init__("Translation fault, level {}".format(level))
+        self.level = level
+        self.descriptor = descriptor
+
+# A software TLB. Decoded tables and finished translations are kept
+# until the next stop, like the registers, so translating many addresses
+# in a row costs one read per distinct table.
+class SoftwareTLB():
+    def __init__(self):
+        self.tables = {}
+        self.translations = {}
+
+    def invalidate(self, event=None):
+        self.tables.clear()
+        self.translations.clear()
+
+    def table(self, addr, size):
+        # the size depends on the regime and level the table is reached
+        # from, so the same table may be wanted at more than one size
+        key = (addr, size)
+        if key not in self.tables:
+            self.tables[key] = read_table(addr, size)
+        return self.tables[key]
+
+    def regime(self, va, reg):
+        tcr = registers.read("TCR_EL1")
+        if reg is None:
+            reg = "TTBR1_EL1" if va & (1 << 55) else "TTBR0_EL1"
+        if reg.upper().startswith("TTBR1"):
+            txsz = bitfields.TCR_EL1.field(tcr, "T1SZ")
+            granule = TG1_GRANULES.get(bitfields.TCR_EL1.field(tcr, "TG1"), 12)
+        else:
+            txsz = bitfields.TCR_EL1.field(tcr, "T0SZ")
+            granule = TG0_GRANULES.get(bitfields.TCR_EL1.field(tcr, "TG0"), 12)
+        return reg, 64 - txsz, granule
+
+    def translate(self, va, reg=None):
+        reg, va_bits, granule = self.regime(va, reg)
+        ttbr = registers.read(reg)
+
+        key = (reg, ttbr, va >> granule)
+        if key in self.translations:
+            t = self.translations[key]
+            return t._replace(va=va, pa=t.pa + (va & (t.size - 1)))
+
+        # each level resolves granule-3 bits of the VA, the first level
+        # takes whatever is left over
+        stride = granule - 3
+        levels = -(-(va_bits - granule) // stride)
+        level = 4 - levels
+        table = ttbr & OA_MASK
+        while True:
+            shift = granule + stride * (3 - level)
+            index_bits = min(stride, va_bits - shift)
+            index = (va >> shift) & ((1 << index_bits) - 1)
+            entries = self.table(table, 8 << index_bits)
+            descriptor = int(entries[index])
+
+            if not descriptor & 1:
+                raise TranslationFault(level, descriptor)
+            if is_table_descriptor(descriptor, level):
+                table = descriptor & OA_MASK & ~((1 << granule) - 1)
+                level += 1
+                continue
+            if not is_leaf_descriptor(descriptor, level):
+                raise TranslationFault(level, descriptor)
+
+            size = 1 << shift
+            base = descriptor & OA_MASK & ~(size - 1)
+            self.translations[key] = Translation(va & ~(size - 1), base, level, size, descriptor)
+            return Translation(va, base + (va & (size - 1)), level, size, descriptor)
+
+tlb = SoftwareTLB()
+
+class Armv8AVirtualToPhysical(stats.Command):
+    def __init__(self):
+        super (Armv8AVirtualToPhysical, self).__init__("vtop", gdb.COMMAND_DATA)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        if len(argv) not in (1, 2):
+            raise gdb.GdbError("Usage: vtop <addr> [TTBR0_EL1|TTBR1_EL1]")
+
+        va = symbols.parse_address(argv[0])
+        reg = argv[1] if len(argv) == 2 else None
+
+        try:
+            t = tlb.translate(va, reg)
+        except TranslationFault as fault:
+            print("0x{:016x}: {} (descriptor 0x{:016x})".format(va, fault, fault.descriptor))
+            return
+
+        kind = "page" if t.level == 3 else "block"
+        print("0x{:016x} -> 0x{:012x}  L{} {} {}".format(va, t.pa, t.level, format_size(t.size), kind), end=' ')
+        print(format_bitfields_short(t.descriptor, table_descriptor.block_descriptor_bitfields, Armv8AMemoryMap.block_summary))
+
+Armv8AVirtualToPhysical()
+
+# PC and SP, then what says whether a core faulted and how its MMU is set up
+CORE_REGISTERS = ("pc", "sp", "ESR_EL1", "FAR_EL1", "ELR_EL1", "SCTLR_EL1", "TTBR0_EL1")
+
+def for_each_thread(fn):
+    # calls fn(thread) with each thread of the inferior selected in turn
+    # and returns the results, leaving the selection as it was
+    selected = gdb.selected_thread()
+    if selected is None:
+        raise gdb.GdbError("No thread selected")
+    try:
+        frame = gdb.selected_frame()
+    except gdb.error:
+        # nothing to restore beyond the thread
+        frame = None
+    results = []
+    try:
+        for thread in sorted(gdb.selected_inferior().threads(), key=lambda t: t.num):
+            thread.switch()
+            results.append((thread, fn(thread)))
+    finally:
+        selected.switch()
+        if frame is not None and frame.is_valid():
+            frame.select()
+    return results
+
+def read_core_registers(thread):
+    values = {}
+    for reg in CORE_REGISTERS:
+        try:
+            values[reg] = registers.read(reg)
+        except (ValueError, gdb.error):
+            values[reg] = None
+    return values
+
+class AllCores(stats.Command):
+    def __init__(self):
+        super (AllCores, self).__init__("allcores", gdb.COMMAND_STATUS)
+
+    def invoke(self, arg, from_tty):
+        # a command reads only the registers it needs, through the
+        # register cache
+        if arg.strip():
+            def run(thread):
+                print("[Thread {}]".format(thread.num))
+                gdb.execute(arg, from_tty)
+            for_each_thread(run)
+        else:
+            self.show(for_each_thread(read_core_registers))
+
+    def show(self, cores):
+        print("{:<11}".format(""), end='')
+        for thread, _ in cores:
+            print(" {:>18}".format("Thread {}".format(thread.num)), end='')
+        print()
+
+        for reg in CORE_REGISTERS:
+            values = [regs[reg] for _, regs in cores]
+            differs = len(set(values)) > 1 and reg not in ("pc", "sp")
+            print("{:<10}{}".format(reg.upper(), "*" if differs else " "), end='')
+            for value in values:
+                print(" {:>18}".format("-" if value is None else "0x{:016x}".format(value)), end='')
+            print()
+
+        for thread, regs in cores:
+            esr = regs["ESR_EL1"]
+            if not esr:
+                continue
+            ec = (esr >> 26) & 0x3f
+            print("Thread {}: {} at 0x{:016x}".format(
+                thread.num, Armv8AException.error_codes.get(ec, "EC 0x{:02x}".format(ec)), regs["ELR_EL1"] or 0))
+
+AllCores()
+
+# System register snapshots
+#
+# sysregs reads the registers named in sysregs-registers through the
+# register cache, so each costs one read per stop however many commands
+# look at it, and keeps the values of every thread it has seen. A run
+# prints only what changed since the previous run on the same thread:
+# the changed fields, old -> new, for registers with a layout in
+# bitfields.py, the raw values for the rest. A register the target does
+# not have is dropped after its first failed read instead of being
+# asked for on every step.
+
+DEFAULT_SYSREGS = "CurrentEL SCTLR_EL1 TCR_EL1 TTBR0_EL1 TTBR1_EL1 MAIR_EL1 VBAR_EL1 HCR_EL2 ESR_EL1"
+
+class SystemRegisterSnapshot():
+    def __init__(self):
+        self.previous = {}
+        self.missing = set()
+
+    def reset(self, event=None):
+        self.previous.clear()
+        self.missing.clear()
+
+    def read(self, names):
+        values = {}
+        for reg in names:
+            if reg in self.missing:
+                continue
+            try:
+                values[reg] = registers.read(reg)
+            except (ValueError, gdb.error):
+                print("sysregs: no register {}, leaving it out".format(reg))
+                self.missing.add(reg)
+        return values
+
+    def update(self, names):
+        # returns the thread's previous values (empty the first time)
+        # and the current ones, which replace them
+        thread = gdb.selected_thread().global_num
+        values = self.read(names)
+        previous = self.previous.get(thread, {})
+        self.previous[thread] = values
+        return previous, values
+
+snapshot = SystemRegisterSnapshot()
+
+def format_register(reg, value):
+    return "{:<10} 0x{:016x}".format(reg, value)
+
+def format_register_changes(reg, old, new):
+    lines = ["{:<10} 0x{:016x} -> 0x{:016x}".format(reg, old, new)]
+    layout = bitfields.REGISTERS.get(reg)
+    if layout is not None:
+        lines += ["    " + line for line in layout.changes(old, new)]
+    return lines
+
+class SystemRegisters(stats.Command):
+    def __init__(self):
+        super (SystemRegisters, self).__init__("sysregs", gdb.COMMAND_DATA)
+
+    usage = "Usage: sysregs [-a | -q | reset]"
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        if argv == ["reset"]:
+            snapshot.reset()
+            return
+        if argv not in ([], ["-a"], ["-q"]):
+            raise gdb.GdbError(self.usage)
+
+        previous, values = snapshot.update(gdb.parameter("sysregs-registers").split())
+        lines = []
+        for reg, value in values.items():
+            if reg not in previous or (argv == ["-a"] and previous[reg] == value):
+                lines.append(format_register(reg, value))
+            elif previous[reg] != value:
+                lines += format_register_changes(reg, previous[reg], value)
+
+        if lines:
+            print("\n".join(lines))
+        elif argv != ["-q"]:
+            print("No system register changed")
+
+class SystemRegistersList(gdb.Parameter):
+    def __init__(self):
+        super (SystemRegistersList, self).__init__("sysregs-registers",
+                                                   gdb.COMMAND_DATA,
+                                                   gdb.PARAM_STRING)
+        self.value = DEFAULT_SYSREGS
+
+    set_doc = "Set the system registers read by sysregs"
+    show_doc = "The system registers read by sysregs are"
+
+    def get_set_string(self):
+        # a corrected name should be tried again
+        snapshot.missing.clear()
+        return ""
+
+class SystemRegistersOnStop(gdb.Parameter):
+    def __init__(self):
+        super (SystemRegistersOnStop, self).__init__("sysregs-on-stop",
+                                                     gdb.COMMAND_DATA,
+                                                     gdb.PARAM_BOOLEAN)
+        self.value = False
+
+    set_doc = "Determines if sysregs shows the changed system registers on every stop"
+    show_doc = "Showing changed system registers on every stop is"
+
+def sysregs_on_stop(event):
+    if not gdb.parameter("sysregs-on-stop"):
+        return
+    try:
+        gdb.execute("sysregs -q")
+    except (gdb.error, gdb.GdbError, ValueError) as e:
+        print("sysregs: %s" % e)
+
+SystemRegisters()
+SystemRegistersList()
+SystemRegistersOnStop()
+
+# Exception tracing
+#
+# A breakpoint on each entry of __exception_handler_table records the
+# raw syndrome registers into a ring buffer and returns False from
+# stop(), so gdb resumes the core straight away and no stop event is
+# seen. Nothing is decoded while the target runs: each distinct ESR is
+# decoded once, when the log is shown.
+
+# the vector types from src/exceptions.S, in table order, 0x80 apart
+VECTOR_NAMES = ("SYNCHRONOUS_INVALID_EL1T", "IRQ_INVALID_EL1T", "FIQ_INVALID_EL1T", "ERROR_INVALID_EL1T",
+                "SYNCHRONOUS_EL1H", "IRQ_EL1H", "FIQ_INVALID_EL1H", "ERROR_INVALID_EL1H",
+                "SYNCHRONOUS_INVALID_EL0_64", "IRQ_INVALID_EL0_64", "FIQ_INVALID_EL0_64", "ERROR_INVALID_EL0_64",
+                "SYNCHRONOUS_INVALID_EL0_32", "IRQ_INVALID_EL0_32", "FIQ_INVALID_EL0_32", "ERROR_INVALID_EL0_32")
+VECTOR_SPACING = 0x80
+
+TRACE_REGISTERS = ("ESR_EL1", "FAR_EL1", "ELR_EL1", "SPSR_EL1")
+
+DEFAULT_TRACE_SIZE = 4096
+
+ExceptionRecord = namedtuple('ExceptionRecord', ['time', 'thread', 'vector', 'esr', 'far', 'elr', 'spsr'])
+
+def format_location(addr):
+    if addr is None:
+        return "-"
+    symbol = symbols.symbol_at(addr)
+    if symbol is None or symbol[1] > 0x10000:
+        return "0x{:x}".format(addr)
+    return "0x{:x} <{}+{}>".format(addr, symbol[0], symbol[1])
+
+class ExceptionLog():
+    def __init__(self, size=DEFAULT_TRACE_SIZE):
+        self.records = deque(maxlen=size)
+        self.hits = 0
+        self.started = time.monotonic()
+
+    def clear(self):
+        self.records.clear()
+        self.hits = 0
+        self.started = time.monotonic()
+
+    def record(self, vector):
+        frame = gdb.newest_frame()
+        values = []
+        for reg in TRACE_REGISTERS:
+            try:
+                values.append(int(stats.read_register(frame, reg)) & REGISTER_MASK)
+            except (ValueError, gdb.error):
+                values.append(None)
+        self.records.append(ExceptionRecord(time.monotonic() - self.started,
+                                            gdb.selected_thread().num, vector, *values))
+        self.hits += 1
+
+    @property
+    def dropped(self):
+        return self.hits - len(self.records)
+
+class ExceptionTracepoint(gdb.Breakpoint):
+    def __init__(self, addr, vector, log):
+        super (ExceptionTracepoint, self).__init__("*0x{:x}".format(addr), internal=True)
+        self.vector = vector
+        self.log = log
+
+    def stop(self):
+        self.log.record(self.vector)
+        return False
+
+class TraceExceptions(stats.Command):
+    def __init__(self):
+        super (TraceExceptions, self).__init__("trace-exceptions", gdb.COMMAND_BREAKPOINTS)
+        self.log = ExceptionLog()
+        self.tracepoints = []
+
+    usage = "Usage: trace-exceptions on [<size>] | off | clear | show [<n>] | summary"
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg) or ["show"]
+        if len(argv) > 2:
+            raise gdb.GdbError(self.usage)
+        count = int(gdb.parse_and_eval(argv[1])) if len(argv) == 2 else None
+        if count is not None and count < 0:
+            raise gdb.GdbError("The count must not be negative")
+
+        if argv[0] == "on":
+            self.start(count or DEFAULT_TRACE_SIZE)
+        elif argv[0] == "off":
+            self.stop()
+        elif argv[0] == "clear":
+            self.log.clear()
+        elif argv[0] == "show":
+            self.show(count)
+        elif argv[0] == "summary":
+            self.summary()
+        else:
+            raise gdb.GdbError(self.usage)
+
+    def start(self, size):
+        table = symbols.lookup("__exception_handler_table")
+        if table is None:
+            raise gdb.GdbError("Cannot locate __exception_handler_table")
+        self.stop()
+        self.log = ExceptionLog(size)
+        self.tracepoints = [ExceptionTracepoint(table + VECTOR_SPACING * i, name, self.log)
+                            for i, name in enumerate(VECTOR_NAMES)]
+        print("Tracing exceptions at 0x{:x}, keeping the last {}".format(table, size))
+
+    def stop(self):
+        for tracepoint in self.tracepoints:
+            if tracepoint.is_valid():
+                tracepoint.delete()
+        self.tracepoints = []
+
+    def show(self, count):
+        records = list(self.log.records)
+        if count is not None:
+            records = records[-count:] if count else []
+
+        decoded = {}
+        lines = []
+        for r in records:
+            if r.esr not in decoded:
+                decoded[r.esr] = bitfields.decode_syndrome(r.esr or 0)
+            _, _, ec_text, fsc_text = decoded[r.esr]
+            far = "-" if r.far is None else "0x{:x}".format(r.far)
+            if fsc_text:
+                ec_text += " (" + fsc_text + ")"
+            lines.append("{:10.6f} T{} {:<26} {} FAR {} ELR {}".format(
+                r.time, r.thread, r.vector, ec_text, far, format_location(r.elr)))
+        if lines:
+            print("\n".join(lines))
+        self.print_totals()
+
+    def summary(self):
+        # count the raw values first, then decode each distinct ESR once
+        counts = Counter((r.esr or 0, r.elr) for r in self.log.records)
+        groups = Counter()
+        decoded = {}
+        for (esr, elr), n in counts.items():
+            if esr not in decoded:
+                decoded[esr] = bitfields.decode_syndrome(esr)
+            groups[decoded[esr] + (elr,)] += n
+
+        for (_, _, ec_text, fsc_text, elr), n in groups.most_common():
+            print("{:8d}  {}{}  at {}".format(n, ec_text, " (" + fsc_text + ")" if fsc_text else "",
+                                             format_location(elr)))
+        self.print_totals()
+
+    def print_totals(self):
+        state = "on" if self.tracepoints else "off"
+        print("{} exceptions logged, {} dropped from the ring, tracing {}".format(
+            self.log.hits, self.log.dropped, state))
+
+TraceExceptions()
+
+gdb.events.stop.connect(registers.invalidate)
+gdb.events.register_changed.connect(registers.invalidate)
+memory.source_listeners.append(registers.invalidate)
+gdb.events.stop.connect(tlb.invalidate)
+gdb.events.memory_changed.connect(tlb.invalidate)
+gdb.events.register_changed.connect(tlb.invalidate)
+memory.source_listeners.append(tlb.invalidate)
+gdb.events.stop.connect(sysregs_on_stop)
+memory.source_listeners.append(snapshot.reset)
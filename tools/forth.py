@@ -0,0 +1,673 @@
+# Forth dictionary and stacks, as seen from gdb
+#
+# Not a command script: words.py and the other Forth tools import it.
+#
+# The dictionary index is built by walking the link chain once. It is
+# discarded whenever gdb reports a stop or a memory write, so repeated
+# lookups while the target is stopped cost no target I/O.
+#
+# Words defined by defword/defcode live in .rodata and cannot change
+# for a given kernel build. Their headers are parsed out of the kernel
+# ELF once and cached on disk (in build/.gdb-cache, keyed by the ELF's
+# hash), so only words defined at runtime are read from the target. A
+# cache directory that cannot be written just means the ELF is parsed
+# again next session.
+#
+
+import gdb
+import hashlib
+import json
+import os
+import struct
+from bisect import bisect_right
+from collections import namedtuple
+
+import memory
+import stats
+import symbols
+
+# word header is 40 bytes long
+# 0 - 7: link address
+#     8: flags
+#     9: name length
+# 10-40: name chars, padded with ','
+HEADER_SIZE = 40
+
+F_IMMED = 0x80
+F_HIDDEN = 0x20
+
+Header = namedtuple('Header', ['addr', 'link', 'flags', 'name'])
+
+CELL = 8
+
+def decode_header(addr, mem):
+    link = int.from_bytes(mem[0:8], byteorder='little')
+    flags = mem[8]
+    namelen = mem[9]
+    name = str(mem[10:10+namelen], 'latin-1')
+    return Header(addr, link, flags, name)
+
+def read_header(addr):
+    return decode_header(addr, memory.read(addr, HEADER_SIZE))
+
+def deref(addr):
+    return memory.read_u64(addr)
+
+def get_latest():
+    p_latest = symbols.lookup('var_latest')
+
+    if p_latest is None:
+        raise ValueError("Cannot locate var_latest")
+    else:
+        return deref(p_latest)
+
+def get_here():
+    p_here = symbols.lookup('var_here')
+
+    if p_here is None:
+        return None
+    else:
+        return deref(p_here)
+
+# Headers of the words built into the kernel, read from the ELF's
+# .rodata through the name_* symbols the defword/defcode macros emit.
+class StaticDictionary():
+    def __init__(self, start, end, headers):
+        self.start = start
+        self.end = end
+        self.headers = headers
+
+    def contains(self, addr):
+        return self.start <= addr < self.end
+
+    @classmethod
+    def from_elf(cls, data):
+        sections, raw = symbols.elf_sections(data)
+        if '.rodata' not in sections:
+            raise ValueError("No .rodata section in kernel ELF")
+        _, start, offset, size, _ = sections['.rodata']
+        end = start + size
+
+        headers = {}
+        for name, value, _ in symbols.elf_symbols(data, sections, raw):
+            if name.startswith('name_') and start <= value and value + HEADER_SIZE <= end:
+                pos = offset + value - start
+                headers[value] = decode_header(value, data[pos:pos + HEADER_SIZE])
+        return cls(start, end, headers)
+
+    def to_json(self):
+        return {'start': self.start,
+                'end': self.end,
+                'headers': [list(h) for h in self.headers.values()]}
+
+    @classmethod
+    def from_json(cls, obj):
+        headers = {h[0]: Header(*h) for h in obj['headers']}
+        return cls(obj['start'], obj['end'], headers)
+
+DEFAULT_KERNEL_ELF = 'build/kernel-pi3'
+
+def get_kernel_elf():
+    filename = gdb.current_progspace().filename
+    if filename is None:
+        filename = DEFAULT_KERNEL_ELF
+    return filename
+
+_elf_hashes = {}
+
+def elf_hash(filename):
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    if key not in _elf_hashes:
+        with open(filename, 'rb') as f:
+            _elf_hashes[key] = hashlib.sha256(f.read()).hexdigest()
+    return _elf_hashes[key]
+
+def cache_path(filename, kind):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.gdb-cache')
+    return os.path.join(cache_dir, '%s-%s.json' % (kind, elf_hash(filename)))
+
+def write_cache(path, obj):
+    # raises OSError when the cache directory cannot be written
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(path + '.tmp', path)
+
+_static_dictionaries = {}
+
+def load_static_dictionary(filename):
+    path = cache_path(filename, 'words')
+    if path in _static_dictionaries:
+        return _static_dictionaries[path]
+
+    # the cache only saves parsing the ELF again: one that cannot be
+    # read is a miss, and one that cannot be written is left alone
+    try:
+        with open(path) as f:
+            static = StaticDictionary.from_json(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        static = None
+    if static is None:
+        with open(filename, 'rb') as f:
+            static = StaticDictionary.from_elf(f.read())
+        try:
+            write_cache(path, static.to_json())
+        except OSError:
+            pass
+
+    _static_dictionaries[path] = static
+    return static
+
+# ELFs that could not be read or parsed, not tried again this session
+_static_failures = set()
+
+def get_static_dictionary():
+    # Without the ELF everything is read from the target, as before.
+    filename = get_kernel_elf()
+    if filename in _static_failures:
+        return None
+    try:
+        return load_static_dictionary(filename)
+    except (OSError, ValueError, struct.error) as e:
+        _static_failures.add(filename)
+        print(f"Not using kernel ELF for built-in words: {e}")
+        return None
+
+# Snapshot of the dictionary, taken by walking the link chain once.
+#
+# Each header is read with a single 40 byte read. Names map to the most
+# recent definition, the same one a walk from latest would find first.
+# Header addresses are kept sorted so the word containing an address
+# can be found by bisection. The end of the highest word is taken from
+# 'here' when it can be located, and no word runs past the end of the
+# region its header is in (.rodata, or the data segment up to here), so
+# the gap between the two belongs to no word. Headers inside the
+# kernel's .rodata come from the static dictionary when one is given,
+# and any header already in a previous index is reused rather than
+# read again.
+class DictionaryIndex():
+    def __init__(self, latest, here=None, static=None, previous=None):
+        self.latest = latest
+        self.here = here
+        self.headers = {}
+        self.by_name = {}
+
+        addr = latest
+        # stop on a repeated address rather than looping forever on a
+        # corrupted link
+        while addr != 0 and addr not in self.headers:
+            header = None
+            if static is not None and static.contains(addr):
+                header = static.headers.get(addr)
+            if header is None and previous is not None:
+                header = previous.headers.get(addr)
+            if header is None:
+                header = read_header(addr)
+            self.headers[addr] = header
+            self.by_name.setdefault(header.name, header)
+            addr = header.link
+
+        self.addresses = sorted(self.headers)
+        self.by_cfa = {addr + HEADER_SIZE: header for addr, header in self.headers.items()}
+        self.regions = regions_of(static, here)
+
+    def find(self, name):
+        return self.by_name.get(name)
+
+    def end_of(self, header):
+        i = bisect_right(self.addresses, header.addr)
+        end = self.addresses[i] if i < len(self.addresses) else self.here
+        limit = self.region_end(header.addr)
+        if limit is not None and (end is None or end > limit):
+            end = limit
+        return end
+
+    def region_end(self, addr):
+        for (start, end) in self.regions:
+            if start <= addr < end:
+                return end
+        # outside every known region (no ELF), stop at the next one up
+        above = [start for (start, _) in self.regions if start > addr]
+        return min(above) if above else None
+
+    def around(self, addr):
+        i = bisect_right(self.addresses, addr) - 1
+        if i < 0:
+            return None
+
+        header = self.headers[self.addresses[i]]
+        end = self.end_of(header)
+        if end is None or addr >= end:
+            return None
+        return header
+
+_dictionary = None
+
+def get_dictionary():
+    global _dictionary
+    if _dictionary is None:
+        _dictionary = DictionaryIndex(get_latest(), get_here(), get_static_dictionary())
+    return _dictionary
+
+def invalidate_dictionary(event=None):
+    global _dictionary
+    _dictionary = None
+
+# Integrity checks
+#
+# The link chain is walked without trusting it: every header is checked
+# for a name length that fits the 30 character field, for unknown flag
+# bits and for a link that points back into a known region (the kernel's
+# .rodata and the data segment up to here). A link that does not point
+# to a lower address is reported but followed, with Brent's algorithm
+# catching cycles in linear time and constant memory. The regions are
+# read in one go first, so the walk itself reads from the memory cache.
+
+MAX_NAME = 30
+
+F_KNOWN = F_IMMED | F_HIDDEN
+
+# larger regions are left to be read a block at a time
+PREFETCH_LIMIT = 1024 * 1024
+
+def dictionary_regions(here):
+    return regions_of(get_static_dictionary(), here)
+
+def regions_of(static, here):
+    regions = []
+    if static is not None:
+        regions.append((static.start, static.end))
+    data_segment = symbols.lookup('data_segment')
+    if data_segment is not None and here is not None and data_segment < here:
+        regions.append((data_segment, here))
+    return regions
+
+def check_dictionary(latest, regions=()):
+    # returns the number of headers walked and a list of (addr, problem)
+    def inside(addr):
+        return not regions or any(start <= addr and addr + HEADER_SIZE <= end for (start, end) in regions)
+
+    for (start, end) in regions:
+        if end - start <= PREFETCH_LIMIT:
+            memory.read(start, end - start)
+
+    problems = []
+    if latest != 0 and not inside(latest):
+        problems.append((latest, 'latest is outside the dictionary'))
+        return 0, problems
+
+    count = 0
+    addr = latest
+    tortoise = latest
+    power = steps = 1
+    while addr != 0:
+        mem = memory.read(addr, HEADER_SIZE)
+        link = int.from_bytes(mem[0:8], byteorder='little')
+        flags = mem[8]
+        namelen = mem[9]
+        count += 1
+
+        if namelen > MAX_NAME:
+            problems.append((addr, 'name length %d is longer than %d' % (namelen, MAX_NAME)))
+        if flags & ~F_KNOWN:
+            problems.append((addr, 'unknown flag bits 0x%02x' % (flags & ~F_KNOWN)))
+
+        if link == 0:
+            break
+        if not inside(link):
+            problems.append((addr, 'link 0x%x is outside the dictionary' % link))
+            break
+        if link >= addr:
+            problems.append((addr, 'link 0x%x does not point back' % link))
+        if link == tortoise:
+            problems.append((addr, 'link 0x%x closes a cycle of %d words' % (link, steps)))
+            break
+        if steps == power:
+            tortoise = link
+            power *= 2
+            steps = 0
+        steps += 1
+        addr = link
+
+    # a cycle is walked more than once before it is caught
+    return count, list(dict.fromkeys(problems))
+
+# Decompiling threaded code
+#
+# A colon definition is a codeword (docol) followed by the CFAs of the
+# words it calls. A few primitives take the cells after them as inline
+# data: lit and ['] a single cell, branch and 0branch an offset from
+# the offset cell, litstring a length followed by the characters padded
+# to a cell boundary. (does>) is followed by a copy of the do_shim code
+# (the "bl dodoes" trampoline), then the high-level does> behavior.
+
+# never read more than this much of a word body
+MAX_BODY = 64 * 1024
+
+DEFAULT_SHIM_LEN = 32
+
+def signed(value):
+    return value - (1 << 64) if value & (1 << 63) else value
+
+def format_number(value):
+    n = signed(value)
+    if -10 < n < 10:
+        return str(n)
+    return '%d (%#x)' % (n, value)
+
+def inline_cells(name, cells, i, shim_cells):
+    # how many cells of inline data follow a call to name at cells[i-1]
+    if i >= len(cells):
+        return 0
+    if name in ('lit', "[']", 'branch', '0branch'):
+        return 1
+    if name == 'litstring':
+        return 1 + (cells[i] + CELL - 1) // CELL
+    if name == '(does>)':
+        return shim_cells
+    return 0
+
+def body_cells(data):
+    return struct.unpack_from('<%dQ' % (len(data) // CELL), data)
+
+def shim_cell_count():
+    return (symbols.lookup('do_shim_len') or DEFAULT_SHIM_LEN) // CELL
+
+def decompile_body(dictionary, start, data):
+    cells = body_cells(data)
+    shim_cells = shim_cell_count()
+
+    i = 0
+    while i < len(cells):
+        addr = start + CELL * i
+        value = cells[i]
+        i += 1
+
+        header = dictionary.by_cfa.get(value)
+        if header is None:
+            yield addr, format_number(value)
+            continue
+
+        name = header.name
+        if i >= len(cells):
+            yield addr, name
+        elif name == 'lit':
+            yield addr, 'lit ' + format_number(cells[i])
+        elif name == "[']":
+            target = dictionary.by_cfa.get(cells[i])
+            yield addr, "['] " + (target.name if target else '%#x' % cells[i])
+        elif name in ('branch', '0branch'):
+            offset = signed(cells[i])
+            yield addr, '%s %+d (-> 0x%x)' % (name, offset, addr + CELL + offset)
+        elif name == 'litstring':
+            length = cells[i]
+            text = data[CELL * (i + 1):CELL * (i + 1) + length]
+            yield addr, 'litstring %d "%s"' % (length, str(text, 'latin-1'))
+        elif name == '(does>)':
+            yield addr, name
+            yield addr + CELL, 'bl dodoes (does> shim, %d bytes)' % (shim_cells * CELL)
+        else:
+            yield addr, name
+        i += inline_cells(name, cells, i, shim_cells)
+
+def body_calls(dictionary, start, data):
+    # (site, header) for every word a threaded body calls, including
+    # the targets of ['], skipping inline data
+    cells = body_cells(data)
+    shim_cells = shim_cell_count()
+
+    i = 0
+    while i < len(cells):
+        header = dictionary.by_cfa.get(cells[i])
+        i += 1
+        if header is None:
+            continue
+        yield start + CELL * (i - 1), header
+        if header.name == "[']" and i < len(cells):
+            target = dictionary.by_cfa.get(cells[i])
+            if target is not None:
+                yield start + CELL * i, target
+        i += inline_cells(header.name, cells, i, shim_cells)
+
+# Cross references
+#
+# Maps each word's CFA to the colon definitions whose bodies call it.
+# The scan is saved in build/.gdb-cache under the kernel ELF's hash,
+# together with the latest it covers. Words defined since then are
+# found by walking the link chain down to that latest, and only their
+# bodies are scanned. If the saved latest is no longer in the chain
+# (a reboot, or a forget), everything is scanned again.
+
+class CrossReference():
+    def __init__(self, latest=0, calls=None):
+        self.latest = latest
+        # caller header address -> [[site, callee cfa], ...]
+        self.calls = calls if calls is not None else {}
+        self.callers = {}
+        for caller, sites in self.calls.items():
+            self.add_callers(caller, sites)
+
+    def add_callers(self, caller, sites):
+        for site, callee in sites:
+            self.callers.setdefault(callee, []).append((site, caller))
+
+    def to_json(self):
+        return {'latest': self.latest,
+                'calls': [[caller, sites] for caller, sites in self.calls.items()]}
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(obj['latest'], {caller: sites for caller, sites in obj['calls']})
+
+    def new_headers(self, dictionary):
+        headers = []
+        addr = dictionary.latest
+        while addr != self.latest:
+            header = dictionary.headers.get(addr)
+            if header is None:
+                # the old latest is gone: start over
+                self.calls = {}
+                self.callers = {}
+                return [dictionary.headers[a] for a in dictionary.addresses]
+            headers.append(header)
+            addr = header.link
+        return headers[::-1]
+
+    def update(self, dictionary):
+        docol = symbols.lookup('docol')
+        headers = sorted(self.new_headers(dictionary), key=lambda h: h.addr)
+
+        # neighbouring words are read together, one read per run
+        i = 0
+        while i < len(headers):
+            j = i + 1
+            while j < len(headers) and dictionary.end_of(headers[j - 1]) == headers[j].addr:
+                j += 1
+            run = headers[i:j]
+            start = run[0].addr
+            end = dictionary.end_of(run[-1])
+            last_cfa = run[-1].addr + HEADER_SIZE
+            if end is None or end - last_cfa > MAX_BODY:
+                end = last_cfa + MAX_BODY
+            data = memory.read(start, end - start)
+
+            for header in run:
+                cfa = header.addr + HEADER_SIZE
+                body_end = min(dictionary.end_of(header) or end, end, cfa + MAX_BODY)
+                body = data[cfa - start:body_end - start]
+                if len(body) < CELL or int.from_bytes(body[:CELL], byteorder='little') != docol:
+                    continue
+                sites = [[site, callee.addr + HEADER_SIZE]
+                         for site, callee in body_calls(dictionary, cfa + CELL, body[CELL:])]
+                self.calls[header.addr] = sites
+                self.add_callers(header.addr, sites)
+            i = j
+
+        self.latest = dictionary.latest
+
+    def callers_of(self, header):
+        return self.callers.get(header.addr + HEADER_SIZE, [])
+
+def load_cross_reference():
+    try:
+        with open(cache_path(get_kernel_elf(), 'xref')) as f:
+            return CrossReference.from_json(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return CrossReference()
+
+def save_cross_reference(xref):
+    try:
+        write_cache(cache_path(get_kernel_elf(), 'xref'), xref.to_json())
+    except OSError:
+        pass
+
+_xref = None
+
+def get_cross_reference():
+    global _xref
+    dictionary = get_dictionary()
+    if _xref is None:
+        _xref = load_cross_reference()
+    if _xref.latest != dictionary.latest:
+        _xref.update(dictionary)
+        save_cross_reference(_xref)
+    return _xref
+
+# Forth return stack
+#
+# NIP (x10) points at the next cell of the word being executed, and
+# every docol pushes the caller's NIP onto the return stack (RSP, x27)
+# which grows down from return_stack_top. Each saved NIP points just
+# past the cell that made the call, so the calling word is the one
+# around ip - 8. The whole stack (or its newest max_depth cells) is read
+# with one read.
+
+NIP_REGISTER = 'x10'
+RSP_REGISTER = 'x27'
+
+ForthFrame = namedtuple('ForthFrame', ['level', 'ip', 'slot', 'header'])
+
+def read_return_stack(max_depth=None):
+    frame = gdb.newest_frame()
+    nip = int(stats.read_register(frame, NIP_REGISTER)) & 0xffffffffffffffff
+    rsp = int(stats.read_register(frame, RSP_REGISTER)) & 0xffffffffffffffff
+
+    bottom = symbols.lookup('return_stack')
+    top = symbols.lookup('return_stack_top')
+    if top is None or bottom is None:
+        raise gdb.GdbError("Cannot locate return_stack")
+    if not bottom <= rsp <= top or rsp % CELL:
+        raise gdb.GdbError("RSP 0x%x is outside the return stack (0x%x - 0x%x)" % (rsp, bottom, top))
+
+    if max_depth is not None:
+        top = min(top, rsp + CELL * max_depth)
+    data = memory.read(rsp, top - rsp)
+    return nip, rsp, struct.unpack_from('<%dQ' % (len(data) // CELL), data)
+
+def forth_frames():
+    dictionary = get_dictionary()
+    nip, rsp, cells = read_return_stack()
+
+    yield ForthFrame(0, nip, None, dictionary.around(nip - CELL))
+    for i, ip in enumerate(cells):
+        yield ForthFrame(i + 1, ip, rsp + CELL * i, dictionary.around(ip - CELL))
+
+def frame_label(frame):
+    if frame.header is None:
+        return '??'
+    return '%s+%d' % (frame.header.name, frame.ip - frame.header.addr - HEADER_SIZE)
+
+# Stack mirrors
+#
+# Both stacks grow down, the parameter stack (PSP, x28) from the address
+# in s0 and the return stack from return_stack_top, so a stack holds the
+# cells from its pointer up to its base. A mirror keeps the copy made at
+# the previous refresh. The cells below the old pointer are new, and a
+# few cells above it may have been popped and pushed again, so a refresh
+# reads from the new pointer to REFRESH_CELLS above the higher of the
+# old and new pointers. The rest of the copy is kept if the target's CRC
+# of that range (qCRC) matches it, and read again if not. Targets without
+# qCRC get the whole stack read in one go.
+
+PSP_REGISTER = 'x28'
+
+REFRESH_CELLS = 8
+
+class StackMirror():
+    def __init__(self, name, register, bottom, top, base_variable=None):
+        self.name = name
+        self.register = register
+        self.bottom = bottom
+        self.top = top
+        self.base_variable = base_variable
+        self.invalidate()
+
+    def invalidate(self, event=None):
+        self.pointer = None
+        self.base = None
+        self.data = b''
+        self.use_qcrc = True
+
+    def bounds(self):
+        bottom = symbols.lookup(self.bottom)
+        top = symbols.lookup(self.top)
+        if bottom is None or top is None:
+            raise gdb.GdbError('Cannot locate %s' % self.bottom)
+
+        base = top
+        if self.base_variable is not None:
+            addr = symbols.lookup(self.base_variable)
+            value = memory.read_u64(addr) if addr is not None else None
+            if value is not None and bottom <= value <= top:
+                base = value
+        return bottom, base
+
+    def refresh(self, full=False):
+        # returns the number of bytes read from the target
+        pointer = int(stats.read_register(gdb.newest_frame(), self.register)) & 0xffffffffffffffff
+        bottom, base = self.bounds()
+        if not bottom <= pointer <= base or pointer % CELL:
+            self.invalidate()
+            raise gdb.GdbError('%s 0x%x is outside the %s (0x%x - 0x%x)' %
+                               (self.register, pointer, self.name, bottom, base))
+
+        old = self.pointer
+        if full or old is None or base != self.base or not self.use_qcrc:
+            data = memory.read_uncached(pointer, base - pointer)
+            moved = len(data)
+        else:
+            split = min(max(old, pointer) + CELL * REFRESH_CELLS, base)
+            data = memory.read_uncached(pointer, split - pointer)
+            moved = len(data)
+            kept = self.data[split - old:]
+            if kept:
+                crc = memory.target_crc32(split, len(kept))
+                if crc is None:
+                    self.use_qcrc = False
+                if crc != memory.remote_crc32(kept):
+                    kept = memory.read_uncached(split, base - split)
+                    moved += len(kept)
+            data = bytes(data) + bytes(kept)
+
+        self.pointer = pointer
+        self.base = base
+        self.data = bytes(data)
+        return moved
+
+    def cells(self):
+        # top of stack first
+        return struct.unpack_from('<%dQ' % (len(self.data) // CELL), self.data)
+
+parameter_stack = StackMirror('parameter stack', PSP_REGISTER, 'data_stack', 'data_stack_top', 'var_s0')
+return_stack = StackMirror('return stack', RSP_REGISTER, 'return_stack', 'return_stack_top')
+
+def invalidate_stacks(event=None):
+    parameter_stack.invalidate()
+    return_stack.invalidate()
+
+gdb.events.stop.connect(invalidate_dictionary)
+gdb.events.memory_changed.connect(invalidate_dictionary)
+memory.source_listeners.append(invalidate_dictionary)
+gdb.events.memory_changed.connect(invalidate_stacks)
+memory.source_listeners.append(invalidate_stacks)
@@ -0,0 +1,232 @@
+# Sampling profiler for Forth words, for use in gdb
+#
+# From gdb, run "source tools/fprofile.py"
+#
+# Usage:
+#   fprofile <samples> [<interval-ms>] [<output-prefix>]
+#   fprofile stop
+#
+# Start from a stopped target (e.g. "make debug_emulate" and "make gdb").
+# The profiler resumes the target with "continue &", interrupts it every
+# <interval-ms> milliseconds (default 10) and records where it was:
+# the PC, the word around NIP and the chain of words on the return
+# stack. After <samples> samples, a breakpoint stop or "fprofile stop"
+# the target is left stopped and the profile is printed and written to
+#   <output-prefix>.txt     - flat profile, self and total per word
+#   <output-prefix>.folded  - folded stacks, for flamegraph.pl and friends
+# The prefix defaults to "fprofile".
+#
+# Each sample costs three register reads, one read of var_latest and one
+# read of the newest cells of the return stack. Names come from a
+# dictionary index kept across samples and only rebuilt (reusing the
+# headers it already has) when latest changes, and PC symbols from the
+# sorted table in symbols.py.
+#
+
+import gdb
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import forth
+import stats
+import symbols
+
+DEFAULT_INTERVAL_MS = 10
+DEFAULT_PREFIX = 'fprofile'
+
+# deepest return stack chain recorded per sample
+MAX_DEPTH = 64
+
+# rows of the flat profile printed in gdb (the file gets all of them)
+PRINT_ROWS = 25
+
+class Profile():
+    def __init__(self):
+        self.samples = 0
+        self.folded = Counter()
+        self.self_words = Counter()
+        self.total_words = Counter()
+        self.self_pcs = Counter()
+
+    def add(self, stack, pc_name):
+        # stack runs from the outermost caller to the current word
+        self.samples += 1
+        self.folded[';'.join(stack + [pc_name])] += 1
+        self.self_pcs[pc_name] += 1
+        if stack:
+            self.self_words[stack[-1]] += 1
+        for name in set(stack):
+            self.total_words[name] += 1
+
+    def flat_lines(self, rows=None):
+        total = max(self.samples, 1)
+        lines = ['  self%     self  total%    total  word']
+        for name, count in self.total_words.most_common(rows):
+            own = self.self_words[name]
+            lines.append('%6.2f%% %8d %6.2f%% %8d  %s' % (100.0 * own / total, own,
+                                                         100.0 * count / total, count, name))
+        lines.append('')
+        lines.append('  self%     self  pc')
+        for name, count in self.self_pcs.most_common(rows):
+            lines.append('%6.2f%% %8d  %s' % (100.0 * count / total, count, name))
+        return lines
+
+    def folded_lines(self):
+        return ['%s %d' % (stack, count) for stack, count in sorted(self.folded.items())]
+
+class Sampler():
+    def __init__(self):
+        self.dictionary = None
+        self.pc_names = {}
+
+    def refresh_dictionary(self):
+        try:
+            latest = forth.get_latest()
+        except (ValueError, gdb.error):
+            self.dictionary = None
+            return
+        here = forth.get_here()
+        # here moves while a word is being compiled, and the newest
+        # word's extent with it (the same test as words.stack_dictionary)
+        previous = self.dictionary
+        if previous is None or previous.latest != latest or previous.here != here:
+            self.dictionary = forth.DictionaryIndex(latest, here,
+                                                    forth.get_static_dictionary(),
+                                                    previous=previous)
+
+    def word_name(self, ip):
+        header = self.dictionary.around(ip - forth.CELL)
+        return '??' if header is None else header.name
+
+    def pc_name(self, pc):
+        if pc not in self.pc_names:
+            found = symbols.symbol_at(pc)
+            self.pc_names[pc] = '0x%x' % pc if found is None else found[0]
+        return self.pc_names[pc]
+
+    def sample(self):
+        pc = gdb.newest_frame().pc()
+        stack = []
+        self.refresh_dictionary()
+        if self.dictionary is not None:
+            try:
+                nip, _, cells = forth.read_return_stack(MAX_DEPTH)
+            except (gdb.error, gdb.GdbError):
+                # not running Forth yet, or RSP is elsewhere
+                cells = None
+            if cells is not None:
+                stack = [self.word_name(ip) for ip in reversed(cells)]
+                stack.append(self.word_name(nip))
+        return stack, self.pc_name(pc)
+
+class Profiler():
+    def __init__(self):
+        self.running = False
+        self.timer = None
+
+    def start(self, samples, interval, prefix):
+        if self.running:
+            raise gdb.GdbError('fprofile is already running; use "fprofile stop"')
+        self.wanted = samples
+        self.interval = interval
+        self.prefix = prefix
+        self.profile = Profile()
+        self.sampler = Sampler()
+        self.sample_time = 0.0
+        self.stopping = False
+        self.running = True
+        gdb.events.stop.connect(self.on_stop)
+        self.resume()
+
+    def resume(self):
+        if not self.running:
+            return
+        if self.stopping:
+            self.finish()
+            return
+        gdb.execute('continue &')
+        self.timer = threading.Timer(self.interval, gdb.post_event, (self.interrupt,))
+        self.timer.start()
+
+    def interrupt(self):
+        if self.running:
+            gdb.execute('interrupt')
+
+    def stop(self):
+        if not self.running:
+            raise gdb.GdbError('fprofile is not running')
+        self.stopping = True
+        if self.timer is not None:
+            self.timer.cancel()
+        if gdb.selected_thread().is_running():
+            self.interrupt()
+
+    def on_stop(self, event):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.stopping or isinstance(event, gdb.BreakpointEvent):
+            self.finish()
+            return
+
+        started = time.perf_counter()
+        try:
+            stack, pc_name = self.sampler.sample()
+        except gdb.error as e:
+            print('fprofile: %s' % e)
+            self.finish()
+            return
+        self.sample_time += time.perf_counter() - started
+        self.profile.add(stack, pc_name)
+
+        if self.profile.samples >= self.wanted:
+            self.finish()
+        else:
+            # gdb cannot resume the target from inside a stop handler
+            gdb.post_event(self.resume)
+
+    def finish(self):
+        self.running = False
+        gdb.events.stop.disconnect(self.on_stop)
+        profile = self.profile
+
+        lines = profile.flat_lines()
+        with open(self.prefix + '.txt', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        with open(self.prefix + '.folded', 'w') as f:
+            f.write('\n'.join(profile.folded_lines()) + '\n')
+
+        print('\n'.join(profile.flat_lines(PRINT_ROWS)))
+        if profile.samples:
+            print('%d samples, %.2f ms per sample spent in gdb (interval %.2f ms)' %
+                  (profile.samples, 1000.0 * self.sample_time / profile.samples, 1000.0 * self.interval))
+        print('Wrote %s.txt and %s.folded' % (self.prefix, self.prefix))
+
+profiler = Profiler()
+
+class ForthProfile(stats.Command):
+    def __init__(self):
+        super(ForthProfile, self).__init__('fprofile', gdb.COMMAND_RUNNING)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+
+        if argv == ['stop']:
+            profiler.stop()
+            return
+        if not 1 <= len(argv) <= 3:
+            raise gdb.GdbError('Usage: fprofile <samples> [<interval-ms>] [<output-prefix>] | fprofile stop')
+
+        try:
+            samples = int(argv[0])
+            interval = float(argv[1]) if len(argv) > 1 else DEFAULT_INTERVAL_MS
+        except ValueError:
+            raise gdb.GdbError('Sample count and interval must be numbers.')
+        prefix = argv[2] if len(argv) > 2 else DEFAULT_PREFIX
+
+        profiler.start(samples, interval / 1000.0, prefix)
+
+ForthProfile()
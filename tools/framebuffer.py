@@ -0,0 +1,182 @@
+# Frame buffer capture for use in gdb
+#
+# From gdb, run "source tools/framebuffer.py"
+#
+# Usage:
+#   fbcapture [-i] <file.png>
+#
+# Writes the screen to a PNG. The geometry comes from fb_parameters
+# (src/video.S) and the palette from the set-palette tag of
+# fb_init_message, the same values the GPU was given. The PNG is
+# palettized like the frame buffer itself, so pixels are written out as
+# read and the palette goes in the PNG's PLTE chunk; entries the kernel
+# never set are shown as a grey ramp.
+#
+# The frame buffer is read in bands of whole text rows (16 pixel rows),
+# each a contiguous range, with adjacent bands merged into one read.
+# With -i only the bands that changed since the previous capture are
+# read: the target is asked for each band's CRC (qCRC, see memory.py)
+# and bands with the same CRC are taken from the last capture. Targets
+# without qCRC have every band read.
+#
+
+import gdb
+import os
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import memory
+import stats
+import symbols
+
+# fb_parameters: xres, yres, addr, size, pitch (then colors and cursor)
+FB_PARAMETERS = struct.Struct('<5Q')
+
+# mailbox property tag that carries the palette
+TAG_SET_PALETTE = 0x0004800b
+
+BAND_ROWS = 16
+
+# never read more than this in one go
+MAX_READ = 256 * 1024
+
+class Geometry():
+    def __init__(self, width, height, addr, pitch):
+        self.width = width
+        self.height = height
+        self.addr = addr
+        self.pitch = pitch
+
+    def __eq__(self, other):
+        return other is not None and vars(self) == vars(other)
+
+    def bands(self):
+        for top in range(0, self.height, BAND_ROWS):
+            rows = min(BAND_ROWS, self.height - top)
+            yield self.addr + top * self.pitch, rows * self.pitch
+
+def read_geometry():
+    p_fb = symbols.lookup('fb_parameters')
+    if p_fb is None:
+        raise gdb.GdbError('Cannot locate fb_parameters')
+    width, height, addr, _, pitch = FB_PARAMETERS.unpack(bytes(memory.read(p_fb, FB_PARAMETERS.size)))
+    if addr == 0 or width == 0 or height == 0 or pitch < width:
+        raise gdb.GdbError('The frame buffer has not been set up')
+    return Geometry(width, height, addr, pitch)
+
+def read_palette():
+    # 0x00BBGGRR words, as given to the GPU
+    palette = [(i << 16) | (i << 8) | i for i in range(256)]
+
+    p_msg = symbols.lookup('fb_init_message')
+    if p_msg is None:
+        return palette
+    size = memory.read_u64(p_msg) & 0xffffffff
+    msg = bytes(memory.read(p_msg, min(size, 4096)))
+
+    pos = 8
+    while pos + 12 <= len(msg):
+        tag, length, _ = struct.unpack_from('<3I', msg, pos)
+        if tag == 0:
+            break
+        if tag == TAG_SET_PALETTE and length >= 8:
+            _, count = struct.unpack_from('<2I', msg, pos + 12)
+            count = min(count, (length - 8) // 4, 256)
+            # the GPU overwrites the offset word with its reply, and
+            # the kernel always starts at entry 0
+            palette[:count] = struct.unpack_from('<%dI' % count, msg, pos + 20)
+            break
+        pos += 12 + length
+    return palette
+
+def png_chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+def write_png(filename, geometry, frame, palette):
+    width, height, pitch = geometry.width, geometry.height, geometry.pitch
+    # filter type 0 in front of each row, and the padding past width dropped
+    rows = b''.join(b'\0' + frame[y * pitch:y * pitch + width] for y in range(height))
+    plte = b''.join(struct.pack('BBB', c & 0xff, (c >> 8) & 0xff, (c >> 16) & 0xff) for c in palette)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)))
+        f.write(png_chunk(b'PLTE', plte))
+        f.write(png_chunk(b'IDAT', zlib.compress(rows, 6)))
+        f.write(png_chunk(b'IEND', b''))
+
+class FrameCapture():
+    def __init__(self):
+        self.geometry = None
+        self.frame = None
+        self.crcs = None
+
+    def changed_bands(self, geometry, incremental):
+        bands = list(geometry.bands())
+        if not incremental or geometry != self.geometry:
+            return list(range(len(bands)))
+
+        changed = []
+        for i, (addr, length) in enumerate(bands):
+            crc = memory.target_crc32(addr, length)
+            if crc is None:
+                return list(range(len(bands)))
+            if crc != self.crcs[i]:
+                changed.append(i)
+        return changed
+
+    def capture(self, incremental):
+        geometry = read_geometry()
+        changed = self.changed_bands(geometry, incremental)
+        if geometry != self.geometry:
+            self.geometry = geometry
+            self.frame = bytearray(geometry.pitch * geometry.height)
+            self.crcs = [None] * len(changed)
+
+        bands = list(geometry.bands())
+        band_bytes = BAND_ROWS * geometry.pitch
+        moved = 0
+        i = 0
+        while i < len(changed):
+            # merge runs of adjacent bands into one read
+            j = i + 1
+            while (j < len(changed) and changed[j] == changed[j - 1] + 1 and
+                   (j - i + 1) * band_bytes <= MAX_READ):
+                j += 1
+            start = bands[changed[i]][0]
+            last_addr, last_length = bands[changed[j - 1]]
+            data = memory.read_uncached(start, last_addr + last_length - start)
+            offset = start - geometry.addr
+            self.frame[offset:offset + len(data)] = data
+            moved += len(data)
+
+            for band in changed[i:j]:
+                addr, length = bands[band]
+                self.crcs[band] = memory.remote_crc32(data[addr - start:addr - start + length])
+            i = j
+
+        return len(changed), len(bands), moved
+
+_capture = FrameCapture()
+
+class FrameBufferCapture(stats.Command):
+    def __init__(self):
+        super(FrameBufferCapture, self).__init__('fbcapture', gdb.COMMAND_DATA)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+
+        incremental = '-i' in argv
+        argv = [a for a in argv if a != '-i']
+        if len(argv) != 1:
+            raise gdb.GdbError('Usage: fbcapture [-i] <file.png>')
+
+        changed, total, moved = _capture.capture(incremental)
+        write_png(argv[0], _capture.geometry, bytes(_capture.frame), read_palette())
+        print('%dx%d to %s: read %d of %d bands (%d bytes)' %
+              (_capture.geometry.width, _capture.geometry.height, argv[0], changed, total, moved))
+
+FrameBufferCapture()
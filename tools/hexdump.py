@@ -3,7 +3,20 @@
 # From gdb, run "source tools/hexdump.py"
 #
 # Usage:
-#   hd <location> <length>
+#   hd <location> <length> [> <file>]
+#   findcell <value> <start> <length> [--aligned]
+#
+# Memory is read and printed in bounded chunks, so large regions (the
+# frame buffer, all of RAM) can be dumped, or written to a file with
+# "> file" (">> file" appends), without holding the whole dump.
+#
+# With memory-dump-file (see memory.py) hd reads from a RAM image or
+# core file instead of the target.
+#
+# findcell lists every place in a range that holds the 64-bit <value>
+# (little-endian), or with --aligned only those on a cell boundary,
+# each with the Forth word it falls in. The range is read a megabyte at
+# a time, so all of RAM can be searched for stray references to a word.
 #
 # Settings:
 #   hex-dump-align <bool>
@@ -13,64 +26,194 @@
 #     How many bytes per line to print. Defaults to 16.
 
 import gdb
-from curses.ascii import isgraph
-
-def groups_of(iterable, size, first=0):
-    first = first if first != 0 else size
-    chunk, iterable = iterable[:first], iterable[first:]
-    while chunk:
-        yield chunk
-        chunk, iterable = iterable[:size], iterable[size:]
-
-class HexDump(gdb.Command):
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import forth
+import memory
+import stats
+import symbols
+
+# Dumps are read this many bytes at a time (rounded down to whole lines).
+# Anything bigger than one chunk bypasses the memory cache.
+CHUNK_SIZE = 64 * 1024
+
+# graphic characters and space print as themselves, everything else as '.'
+PRINTABLE = bytes(b if 0x20 <= b < 0x7f else ord('.') for b in range(256))
+
+def column_header(start, width):
+    digits = ['%01X' % (i&0x0f,) for i in range(start, start+width)]
+    return '          ' + '  '.join(digits) + ' ' + ' '.join(digits)
+
+def format_line(line_addr, group, lead, width):
+    # lead is the number of empty columns before the first byte
+    pad = width - lead - len(group)
+    return ('0x%x: ' % (line_addr,) + '   ' * lead +
+            group.hex(' ').upper() + '   ' * pad + ' ' +
+            '  ' * lead + ' '.join(bytes(group).translate(PRINTABLE).decode('latin-1')))
+
+def hexdump_lines(addr, length, width, align):
+    read = memory.read if length <= CHUNK_SIZE else memory.read_uncached
+    chunk_lines = max(1, CHUNK_SIZE // width)
+
+    end = addr + length
+    lead = addr % width if align else 0
+    line_addr = addr - lead
+    line_start = addr
+    line_end = min(end, line_addr + width)
+
+    yield column_header(line_addr & 0xff, width)
+
+    while line_start < end:
+        chunk_end = min(end, line_end + (chunk_lines - 1) * width)
+        data = read(line_start, chunk_end - line_start)
+        offset = 0
+        lines = []
+        while line_start < chunk_end:
+            size = line_end - line_start
+            lines.append(format_line(line_addr, data[offset:offset + size], lead, width))
+            offset += size
+            line_addr += width
+            line_start = line_end
+            line_end = min(end, line_start + width)
+            lead = 0
+        yield '\n'.join(lines)
+
+def parse_redirect(argv):
+    # split "... > file" or "... >> file" off the end of the arguments
+    for i, a in enumerate(argv):
+        if a.startswith('>'):
+            mode = 'a' if a.startswith('>>') else 'w'
+            target = a.lstrip('>') or ' '.join(argv[i+1:])
+            if not target:
+                raise gdb.GdbError('Missing file name after >')
+            return argv[:i], target, mode
+    return argv, None, None
+
+class HexDump(stats.Command):
     def __init__(self):
         super (HexDump, self).__init__ ('hd', gdb.COMMAND_DATA)
 
     def invoke(self, arg, from_tty):
-        argv = gdb.string_to_argv(arg)
+        argv, filename, mode = parse_redirect(gdb.string_to_argv(arg))
 
-        addr = gdb.parse_and_eval(argv[0]).cast(
-            gdb.lookup_type('void').pointer())
+        addr = symbols.parse_address(argv[0])
         if len(argv) == 2:
              try:
                  bytes = int(gdb.parse_and_eval(argv[1]))
              except ValueError:
-                 raise gdb.GdbError('Byte count numst be an integer value.')
+                 raise gdb.GdbError('Byte count must be an integer value.')
         else:
              bytes = 500
 
-        # print(' parsed arg1 as %s' % addr , end="")
-
-        inferior = gdb.selected_inferior()
-
         align = gdb.parameter('hex-dump-align')
         width = gdb.parameter('hex-dump-width')
-        if width == 0:
+        if not width:
             width = 16
 
-        mem = inferior.read_memory(addr, bytes)
-        pr_addr = int(str(addr).split()[0], 16)
-        pr_offset = width
+        if filename is None:
+            for text in hexdump_lines(addr, bytes, width, align):
+                print(text)
+        else:
+            with open(filename, mode) as f:
+                for text in hexdump_lines(addr, bytes, width, align):
+                    f.write(text)
+                    f.write('\n')
+
+# findcell reads this many bytes at a time, bypassing the memory cache
+SEARCH_CHUNK = 1024 * 1024
+
+CELL = 8
+
+def find_all(data, pattern):
+    i = data.find(pattern)
+    while i >= 0:
+        yield i
+        i = data.find(pattern, i + 1)
+
+def find_aligned(data, value):
+    # offsets of whole cells equal to value; data is a whole number of cells
+    if numpy is not None:
+        cells = numpy.frombuffer(data, dtype='<u8')
+        return (numpy.flatnonzero(cells == value) * CELL).tolist()
+    pattern = value.to_bytes(CELL, byteorder='little')
+    return [i for i in find_all(data, pattern) if i % CELL == 0]
+
+def find_cells(value, start, length, aligned):
+    # yields the address of every match, and skips (with a message)
+    # chunks the target refuses to read
+    end = start + length
+    pattern = value.to_bytes(CELL, byteorder='little')
+    if aligned:
+        start += -start % CELL
+        end -= end % CELL
+    tail = b''
+
+    pos = start
+    while pos < end:
+        size = min(SEARCH_CHUNK, end - pos)
+        try:
+            chunk = bytes(memory.read_uncached(pos, size))
+        except gdb.MemoryError:
+            print('Cannot read 0x%x - 0x%x, skipped' % (pos, pos + size))
+            pos += size
+            tail = b''
+            continue
+
+        if aligned:
+            for offset in find_aligned(chunk, value):
+                yield pos + offset
+        else:
+            # the previous chunk's last 7 bytes catch values that
+            # straddle the boundary
+            data = tail + chunk
+            base = pos - len(tail)
+            for offset in find_all(data, pattern):
+                yield base + offset
+            tail = data[-(CELL - 1):]
+        pos += size
+
+def enclosing_word(dictionary, addr):
+    if dictionary is None:
+        return ''
+    header = dictionary.around(addr)
+    if header is None:
+        return ''
+    return '%s+%d' % (header.name, addr - header.addr - forth.HEADER_SIZE)
+
+class FindCell(stats.Command):
+    def __init__(self):
+        super (FindCell, self).__init__ ('findcell', gdb.COMMAND_DATA)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
 
-        if align:
-            pr_offset = width - (pr_addr % width)
-            pr_addr -= pr_addr % width
-        start=(pr_addr) & 0xff;
+        aligned = '--aligned' in argv
+        argv = [a for a in argv if a != '--aligned']
+        if len(argv) != 3:
+            raise gdb.GdbError('Usage: findcell <value> <start> <length> [--aligned]')
 
+        value = symbols.parse_address(argv[0])
+        start = symbols.parse_address(argv[1])
+        length = int(gdb.parse_and_eval(argv[2]))
 
-        print ('          ' , end="")
-        print ('  '.join(['%01X' % (i&0x0f,) for i in range(start,start+width)]) , end="")
-        print (' ' , end="")
-        print (' '.join(['%01X' % (i&0x0f,) for i in range(start,start+width)]) )
+        try:
+            dictionary = forth.get_dictionary()
+        except (ValueError, gdb.error, gdb.MemoryError):
+            dictionary = None
 
-        for group in groups_of(mem, width, pr_offset):
-            print ('0x%x: ' % (pr_addr,) + '   '*(width - pr_offset), end="")
-            print (' '.join(['%02X' % (ord(g),) for g in group]) + \
-                '   ' * (width - len(group) if pr_offset == width else 0) + ' ', end="")
-            print (' '*(width - pr_offset) +  ' '.join(
-                [chr( int.from_bytes(g, byteorder='big')) if isgraph( int.from_bytes(g, byteorder='big')   ) or g == ' ' else '.' for g in group]))
-            pr_addr += width
-            pr_offset = width
+        hits = 0
+        for addr in find_cells(value, start, length, aligned):
+            word = enclosing_word(dictionary, addr)
+            print('0x%x\t%s' % (addr, word) if word else '0x%x' % addr)
+            hits += 1
+        print('%d matches' % hits)
 
 class HexDumpAlign(gdb.Parameter):
     def __init__(self):
@@ -92,5 +235,6 @@ class HexDumpWidth(gdb.Parameter):
     show_doc = 'The number of bytes per line in hex-dump is'
 
 HexDump()
+FindCell()
 HexDumpAlign()
 HexDumpWidth()
@@ -0,0 +1,305 @@
+# Target memory access shared by the gdb tools
+#
+# Not a command script: words.py, hexdump.py and cortex-a.py import it.
+#
+# Reads go through a cache of aligned 4K blocks. Missing blocks that
+# are next to each other are fetched with a single read_memory, so a
+# run of small reads over the remote link costs one round trip per
+# contiguous range instead of one per read. The cache is dropped when
+# gdb reports a stop, a memory write or an inferior function call.
+#
+# Device memory is never cached: reads that touch an uncached range
+# (the peripheral windows by default) go straight to the target.
+#
+# Instead of a live target, reads can be served from a dump file: a raw
+# RAM image loaded at a base address, or an ELF core file (from gcore or
+# QEMU's dump-guest-memory) whose PT_LOAD segments give the addresses.
+# The file is mapped with mmap and reads return memoryview slices of it,
+# so nothing is copied and no target is needed.
+#
+# target_crc32 asks the target itself for the CRC of a range (the qCRC
+# packet that compare-sections uses), so callers can tell whether memory
+# changed without reading it. remote_crc32 computes the same CRC here.
+#
+# Commands:
+#   memory-cache-uncached [<start> <length>]
+#                    - list the uncached ranges, or add one
+#   memory-dump-file [<file> [<base>] | off]
+#                    - read memory from a RAM image or core file instead
+#                      of the target (base defaults to 0), or go back to
+#                      the target with "off"
+#
+# Settings:
+#   memory-cache <bool>
+#     When false, every read goes straight to the target.
+#
+
+import binascii
+import gdb
+import mmap
+import re
+import struct
+from bisect import bisect_right
+from collections import OrderedDict
+
+import stats
+
+BLOCK_SIZE = 4096
+
+# 16M of cached target memory before the least recently used blocks
+# are dropped.
+MAX_BLOCKS = 4096
+
+# Peripheral windows from include/asm/aarch64/rpi3_registers.h and
+# rpi4_registers.h. The Pi 3 window is followed by the ARM local
+# peripherals at 0x40000000.
+UNCACHED_RANGES = [
+    (0x3f000000, 0x40040000),
+    (0x7e000000, 0x7f000000),
+]
+
+class MemoryCache():
+    def __init__(self, block_size=BLOCK_SIZE, max_blocks=MAX_BLOCKS):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+
+    def invalidate(self, event=None):
+        self.blocks.clear()
+
+    def fetch(self, inferior, first, last):
+        # fetch blocks [first, last] in as few reads as possible
+        size = self.block_size
+        block = first
+        while block <= last:
+            if (inferior.num, block) in self.blocks:
+                self.blocks.move_to_end((inferior.num, block))
+                block += size
+                continue
+
+            start = block
+            while block <= last and (inferior.num, block) not in self.blocks:
+                block += size
+
+            data = bytes(stats.read_memory(inferior, start, block - start))
+            for offset in range(0, len(data), size):
+                self.blocks[(inferior.num, start + offset)] = data[offset:offset + size]
+
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+
+    def read(self, inferior, addr, length):
+        size = self.block_size
+        first = addr - addr % size
+        last = (addr + length - 1) - (addr + length - 1) % size
+        try:
+            self.fetch(inferior, first, last)
+        except gdb.MemoryError:
+            # Whole blocks may reach memory the requested range does
+            # not. Let the target decide about the exact range.
+            return bytes(stats.read_memory(inferior, addr, length))
+
+        if first == last:
+            offset = addr - first
+            return self.blocks[(inferior.num, first)][offset:offset + length]
+
+        parts = [self.blocks[(inferior.num, block)] for block in range(first, last + 1, size)]
+        offset = addr - first
+        return b''.join(parts)[offset:offset + length]
+
+_cache = MemoryCache()
+
+# ELF64 little-endian header and program header, for core files
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+ELF_PROGRAM = struct.Struct('<IIQQQQQQ')
+
+ET_CORE = 4
+PT_LOAD = 1
+
+class DumpFile():
+    def __init__(self, filename, base=0):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        if self.view[:4] == b'\x7fELF':
+            segments = self.core_segments()
+        else:
+            segments = [(base, base + len(self.map), 0)]
+        segments.sort()
+        self.segments = segments
+        self.starts = [start for (start, _, _) in segments]
+
+    def core_segments(self):
+        ident, e_type, _, _, _, phoff, _, _, _, phentsize, phnum, _, _, _ = ELF_HEADER.unpack_from(self.map, 0)
+        if ident[4] != 2 or ident[5] != 1 or e_type != ET_CORE:
+            raise ValueError("Not a little-endian ELF64 core file")
+
+        segments = []
+        for i in range(phnum):
+            p_type, _, offset, vaddr, paddr, filesz, _, _ = ELF_PROGRAM.unpack_from(self.map, phoff + i * phentsize)
+            if p_type == PT_LOAD and filesz:
+                # dump-guest-memory without paging leaves vaddr at 0
+                addr = vaddr or paddr
+                segments.append((addr, addr + filesz, offset))
+        return segments
+
+    def read(self, addr, length):
+        i = bisect_right(self.starts, addr) - 1
+        if i >= 0:
+            start, end, offset = self.segments[i]
+            if addr + length <= end:
+                pos = offset + addr - start
+                return self.view[pos:pos + length]
+        raise gdb.MemoryError("Cannot access memory at address 0x%x in %s" % (addr, self.filename))
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # slices handed out are still alive; the map goes with them
+            pass
+
+_dump = None
+
+# Called with no arguments when reads switch between the target and a
+# dump file, so tools that keep their own caches can drop them.
+source_listeners = []
+
+def attach_dump(filename, base=0):
+    global _dump
+    dump = DumpFile(filename, base)
+    detach_dump()
+    _dump = dump
+    source_changed()
+
+def detach_dump():
+    global _dump
+    if _dump is not None:
+        _dump.close()
+        _dump = None
+        source_changed()
+
+def source_changed():
+    invalidate()
+    for listener in source_listeners:
+        listener()
+
+def is_uncached(addr, length):
+    end = addr + length
+    return any(start < end and addr < stop for (start, stop) in UNCACHED_RANGES)
+
+def read_uncached(addr, length):
+    if length <= 0:
+        return b''
+    if _dump is not None:
+        return _dump.read(int(addr), length)
+    return bytes(stats.read_memory(gdb.selected_inferior(), addr, length))
+
+def read(addr, length):
+    addr = int(addr)
+    if length <= 0:
+        return b''
+    if _dump is not None:
+        return _dump.read(addr, length)
+    if not gdb.parameter('memory-cache') or is_uncached(addr, length):
+        return read_uncached(addr, length)
+    return _cache.read(gdb.selected_inferior(), addr, length)
+
+def read_u64(addr):
+    return int.from_bytes(read(addr, 8), byteorder='little')
+
+def invalidate(event=None):
+    _cache.invalidate()
+
+# gdb's remote CRC (xcrc32) is CRC-32 without bit reflection or final
+# xor. binascii computes the reflected form, so reflect the bytes going
+# in and the result coming out.
+REVERSED_BITS = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+def reverse32(value):
+    return int('{:032b}'.format(value)[::-1], 2)
+
+def remote_crc32(data):
+    return reverse32(binascii.crc32(bytes(data).translate(REVERSED_BITS)) ^ 0xffffffff)
+
+QCRC_REPLY = re.compile(r'received: "?C([0-9a-fA-F]+)')
+
+def target_crc32(addr, length):
+    # None when the target does not implement qCRC, or when reading
+    # from a dump file
+    if _dump is not None:
+        return None
+    try:
+        reply = gdb.execute('maint packet qCRC:%x,%x' % (addr, length), to_string=True)
+    except gdb.error:
+        return None
+    m = QCRC_REPLY.search(reply)
+    return int(m.group(1), 16) if m else None
+
+class MemoryCacheEnabled(gdb.Parameter):
+    def __init__(self):
+        super (MemoryCacheEnabled, self).__init__('memory-cache',
+                                                  gdb.COMMAND_DATA,
+                                                  gdb.PARAM_BOOLEAN)
+        self.value = True
+
+    set_doc = 'Determines if the gdb tools cache target memory between stops'
+    show_doc = 'Caching of target memory by the gdb tools is'
+
+    def get_set_string(self):
+        invalidate()
+        return ''
+
+class MemoryCacheUncached(stats.Command):
+    def __init__(self):
+        super (MemoryCacheUncached, self).__init__('memory-cache-uncached', gdb.COMMAND_DATA)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+
+        if len(argv) == 2:
+            start = int(gdb.parse_and_eval(argv[0]))
+            length = int(gdb.parse_and_eval(argv[1]))
+            UNCACHED_RANGES.append((start, start + length))
+            invalidate()
+        elif len(argv) != 0:
+            raise gdb.GdbError('Usage: memory-cache-uncached [<start> <length>]')
+
+        for (start, stop) in UNCACHED_RANGES:
+            print('0x%08x - 0x%08x' % (start, stop))
+
+class MemoryDumpFile(stats.Command):
+    def __init__(self):
+        super (MemoryDumpFile, self).__init__('memory-dump-file', gdb.COMMAND_FILES)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+
+        if argv == ['off']:
+            detach_dump()
+        elif 1 <= len(argv) <= 2:
+            base = int(gdb.parse_and_eval(argv[1])) if len(argv) == 2 else 0
+            try:
+                attach_dump(argv[0], base)
+            except (OSError, ValueError, struct.error) as e:
+                raise gdb.GdbError('Cannot use %s: %s' % (argv[0], e))
+        elif len(argv) != 0:
+            raise gdb.GdbError('Usage: memory-dump-file [<file> [<base>] | off]')
+
+        if _dump is None:
+            print('Reading memory from the target')
+            return
+        print('Reading memory from %s' % _dump.filename)
+        for (start, end, offset) in _dump.segments:
+            print('0x%08x - 0x%08x  (file offset 0x%x)' % (start, end, offset))
+
+MemoryCacheEnabled()
+MemoryCacheUncached()
+MemoryDumpFile()
+
+gdb.events.stop.connect(invalidate)
+gdb.events.memory_changed.connect(invalidate)
+gdb.events.inferior_call.connect(invalidate)
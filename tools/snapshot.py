@@ -0,0 +1,217 @@
+# Resumable RAM snapshots for use in gdb
+#
+# From gdb, run "source tools/snapshot.py"
+#
+# Usage:
+#   snapshot [--block-size <n>] <file> <start> <length>
+#                    - capture <length> bytes of target memory from <start>
+#   snapshot <file>  - resume an interrupted capture, in the block size
+#                      it was started with
+#   snapshot --delta <file> [<new-file>]
+#                    - bring a finished snapshot up to date, re-reading
+#                      only the blocks that changed. With <new-file>, the
+#                      old snapshot is copied first and kept as it was.
+#
+# A snapshot is a raw image (<file>, usable with "memory-dump-file <file>
+# <start>") and an index (<file>.json) holding the range, the block size
+# and a CRC of each block captured so far. The index is saved every few
+# blocks and when the capture is interrupted, so running the same
+# command again picks up at the first missing block.
+#
+# For --delta the target is asked for the CRC of each block with the
+# remote protocol's qCRC packet (OpenOCD answers it), and only blocks
+# whose CRC differs are transferred. Targets without qCRC (QEMU's gdb
+# stub) get every block read and compared locally instead; the delta
+# then saves disk writes but not transfer time.
+#
+
+import gdb
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import memory
+import stats
+import symbols
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# save the index at least this often during a capture
+SAVE_INTERVAL = 2.0
+
+class Snapshot():
+    def __init__(self, filename, start, length, block_size, crcs=None):
+        self.filename = filename
+        self.start = start
+        self.length = length
+        self.block_size = block_size
+        count = (length + block_size - 1) // block_size
+        self.crcs = crcs if crcs is not None else [None] * count
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename + '.json') as f:
+            obj = json.load(f)
+        return cls(filename, obj['start'], obj['length'], obj['block_size'], obj['crcs'])
+
+    def save(self):
+        obj = {'start': self.start,
+               'length': self.length,
+               'block_size': self.block_size,
+               'crcs': self.crcs}
+        with open(self.filename + '.json.tmp', 'w') as f:
+            json.dump(obj, f)
+        os.replace(self.filename + '.json.tmp', self.filename + '.json')
+
+    def create_image(self):
+        # a new capture starts from an empty image of exactly its length,
+        # whatever was in the file before
+        with open(self.filename, 'w+b') as f:
+            f.truncate(self.length)
+
+    def open_image(self):
+        return open(self.filename, 'r+b')
+
+    def block(self, i):
+        addr = self.start + i * self.block_size
+        return addr, min(self.block_size, self.start + self.length - addr)
+
+    def missing(self):
+        return sum(1 for crc in self.crcs if crc is None)
+
+    def capture(self, blocks, check=None):
+        # read the given blocks into the image. With check, a block is
+        # only stored when check(i) says it may have changed. Returns
+        # the indices of the blocks whose contents changed.
+        changed = []
+        saved = time.monotonic()
+        with self.open_image() as image:
+            try:
+                for i in blocks:
+                    if check is not None and not check(i):
+                        continue
+                    addr, length = self.block(i)
+                    data = memory.read_uncached(addr, length)
+                    crc = memory.remote_crc32(data)
+                    if crc != self.crcs[i]:
+                        image.seek(addr - self.start)
+                        image.write(data)
+                        self.crcs[i] = crc
+                        changed.append(i)
+                    if time.monotonic() - saved > SAVE_INTERVAL:
+                        image.flush()
+                        self.save()
+                        saved = time.monotonic()
+            finally:
+                image.flush()
+                self.save()
+        return changed
+
+    def ranges(self, blocks):
+        # merge adjacent block indices into (addr, length) ranges
+        ranges = []
+        for i in blocks:
+            addr, length = self.block(i)
+            if ranges and ranges[-1][0] + ranges[-1][1] == addr:
+                ranges[-1][1] += length
+            else:
+                ranges.append([addr, length])
+        return ranges
+
+def delta_check(snapshot):
+    use_qcrc = [True]
+
+    def check(i):
+        if not use_qcrc[0]:
+            return True
+        crc = memory.target_crc32(*snapshot.block(i))
+        if crc is None:
+            print('Target does not answer qCRC, reading every block')
+            use_qcrc[0] = False
+            return True
+        return crc != snapshot.crcs[i]
+
+    return check
+
+class SnapshotCommand(stats.Command):
+    def __init__(self):
+        super(SnapshotCommand, self).__init__('snapshot', gdb.COMMAND_FILES)
+
+    usage = ('Usage: snapshot [--block-size <n>] <file> <start> <length> | '
+             'snapshot <file> | snapshot --delta <file> [<new-file>]')
+
+    def invoke(self, arg, from_tty):
+        self.dont_repeat()
+        argv = gdb.string_to_argv(arg)
+
+        delta = '--delta' in argv
+        argv = [a for a in argv if a != '--delta']
+        block_size = None
+        if '--block-size' in argv:
+            i = argv.index('--block-size')
+            try:
+                block_size = int(gdb.parse_and_eval(argv[i + 1]))
+            except IndexError:
+                raise gdb.GdbError(self.usage)
+            if block_size <= 0:
+                raise gdb.GdbError('The block size must be positive')
+            del argv[i:i + 2]
+
+        if delta and len(argv) in (1, 2):
+            self.delta(*argv, block_size=block_size)
+        elif not delta and len(argv) == 1:
+            self.resume(argv[0], block_size)
+        elif not delta and len(argv) == 3:
+            start = symbols.parse_address(argv[1])
+            length = int(gdb.parse_and_eval(argv[2]))
+            snapshot = Snapshot(argv[0], start, length, block_size or DEFAULT_BLOCK_SIZE)
+            snapshot.create_image()
+            self.capture(snapshot)
+        else:
+            raise gdb.GdbError(self.usage)
+
+    def load(self, filename, block_size):
+        try:
+            snapshot = Snapshot.load(filename)
+        except (OSError, ValueError, KeyError) as e:
+            raise gdb.GdbError('Cannot read snapshot index %s.json: %s' % (filename, e))
+        if not os.path.exists(filename):
+            raise gdb.GdbError('Snapshot image %s is missing' % filename)
+        if block_size is not None and block_size != snapshot.block_size:
+            raise gdb.GdbError('Snapshot %s was captured in blocks of 0x%x, not 0x%x' %
+                               (filename, snapshot.block_size, block_size))
+        return snapshot
+
+    def capture(self, snapshot):
+        todo = [i for i, crc in enumerate(snapshot.crcs) if crc is None]
+        print('Capturing %d of %d blocks of 0x%x bytes from 0x%x' %
+              (len(todo), len(snapshot.crcs), snapshot.block_size, snapshot.start))
+        snapshot.capture(todo)
+        print('Snapshot %s complete' % snapshot.filename)
+
+    def resume(self, filename, block_size):
+        snapshot = self.load(filename, block_size)
+        if snapshot.missing() == 0:
+            print('Snapshot %s is already complete; use --delta to update it' % filename)
+            return
+        self.capture(snapshot)
+
+    def delta(self, filename, new_filename=None, block_size=None):
+        snapshot = self.load(filename, block_size)
+        if snapshot.missing():
+            raise gdb.GdbError('Snapshot %s is incomplete; run "snapshot %s" first' % (filename, filename))
+
+        if new_filename is not None:
+            shutil.copyfile(filename, new_filename)
+            snapshot.filename = new_filename
+            snapshot.save()
+
+        changed = snapshot.capture(range(len(snapshot.crcs)), delta_check(snapshot))
+        print('%d of %d blocks changed' % (len(changed), len(snapshot.crcs)))
+        for addr, length in snapshot.ranges(changed):
+            print('0x%08x - 0x%08x' % (addr, addr + length))
+
+SnapshotCommand()
@@ -0,0 +1,138 @@
+# Target I/O accounting shared by the gdb tools
+#
+# Not a command script on its own: the other tools import it, and the
+# first one loaded brings in the tools-stats command.
+#
+# Commands built on stats.Command have every invocation timed. While a
+# command runs, the read_memory and read_register calls made through
+# read_memory() and read_register() here are counted, along with the
+# bytes moved and the time spent waiting for the target. Whatever is
+# left of the command's time was spent in Python.
+#
+# Commands:
+#   tools-stats [reset | json <file>]
+#                    - show per-command totals, clear them, or write
+#                      them to a JSON file
+#
+
+import gdb
+import hashlib
+import json
+import os
+import time
+
+class CommandStats():
+    def __init__(self):
+        self.calls = 0
+        self.memory_reads = 0
+        self.register_reads = 0
+        self.bytes = 0
+        self.target_time = 0.0
+        self.total_time = 0.0
+
+    @property
+    def python_time(self):
+        return self.total_time - self.target_time
+
+    def to_json(self):
+        return {'calls': self.calls,
+                'memory_reads': self.memory_reads,
+                'register_reads': self.register_reads,
+                'bytes': self.bytes,
+                'target_time': self.target_time,
+                'python_time': self.python_time}
+
+_stats = {}
+_current = None
+
+def measured(name, invoke):
+    def wrapper(arg, from_tty):
+        global _current
+        if _current is not None:
+            # a command run from inside another counts for the outer one
+            return invoke(arg, from_tty)
+
+        record = _stats.setdefault(name, CommandStats())
+        _current = record
+        started = time.perf_counter()
+        try:
+            return invoke(arg, from_tty)
+        finally:
+            record.calls += 1
+            record.total_time += time.perf_counter() - started
+            _current = None
+    return wrapper
+
+class Command(gdb.Command):
+    def __init__(self, name, *args, **kwargs):
+        super(Command, self).__init__(name, *args, **kwargs)
+        self.invoke = measured(name, self.invoke)
+
+def read_memory(inferior, addr, length):
+    record = _current
+    if record is None:
+        return inferior.read_memory(addr, length)
+
+    started = time.perf_counter()
+    try:
+        return inferior.read_memory(addr, length)
+    finally:
+        record.memory_reads += 1
+        record.bytes += length
+        record.target_time += time.perf_counter() - started
+
+def read_register(frame, reg):
+    record = _current
+    if record is None:
+        return frame.read_register(reg)
+
+    started = time.perf_counter()
+    try:
+        return frame.read_register(reg)
+    finally:
+        record.register_reads += 1
+        record.target_time += time.perf_counter() - started
+
+def tools_version():
+    # hash of the tool sources, so exported numbers can be matched to
+    # the code that produced them
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(tools_dir)):
+        if name.endswith('.py'):
+            with open(os.path.join(tools_dir, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()[:16]
+
+def to_json():
+    return {'tools_version': tools_version(),
+            'commands': {name: record.to_json() for name, record in sorted(_stats.items())}}
+
+def reset():
+    _stats.clear()
+
+class ToolsStats(gdb.Command):
+    def __init__(self):
+        super(ToolsStats, self).__init__('tools-stats', gdb.COMMAND_SUPPORT)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+
+        if argv == ['reset']:
+            reset()
+            return
+        if len(argv) == 2 and argv[0] == 'json':
+            with open(argv[1], 'w') as f:
+                json.dump(to_json(), f, indent=2)
+            return
+        if argv:
+            raise gdb.GdbError('Usage: tools-stats [reset | json <file>]')
+
+        print('%-20s %6s %8s %6s %12s %11s %11s' %
+              ('command', 'calls', 'reads', 'regs', 'bytes', 'target ms', 'python ms'))
+        for name, record in sorted(_stats.items()):
+            print('%-20s %6d %8d %6d %12d %11.2f %11.2f' %
+                  (name, record.calls, record.memory_reads, record.register_reads, record.bytes,
+                   1000.0 * record.target_time, 1000.0 * record.python_time))
+
+ToolsStats()
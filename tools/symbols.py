@@ -0,0 +1,137 @@
+# Symbol lookup shared by the gdb tools
+#
+# Not a command script: words.py, hexdump.py and cortex-a.py import it.
+#
+# The symbols of each objfile are read from its ELF symbol table once
+# and kept in a dictionary, so lookups cost no gdb round trip. The
+# tables are rebuilt when gdb loads or clears objfiles. Names that are
+# not in any table fall back to gdb's expression evaluator, and the
+# answer is remembered until the next refresh.
+#
+# symbol_at goes the other way, from an address to the nearest symbol at
+# or below it, by bisecting a sorted list of every symbol.
+#
+
+import gdb
+import struct
+from bisect import bisect_right
+
+# ELF64 little-endian layout, just enough to find sections and symbols.
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+ELF_SECTION = struct.Struct('<IIQQQQIIQQ')
+ELF_SYMBOL = struct.Struct('<IBBHQQ')
+
+SHT_SYMTAB = 2
+
+STB_LOCAL = 0
+
+STT_SECTION = 3
+STT_FILE = 4
+
+SHN_UNDEF = 0
+
+def elf_sections(data):
+    ident, _, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx = ELF_HEADER.unpack_from(data, 0)
+    if ident[:4] != b'\x7fELF' or ident[4] != 2 or ident[5] != 1:
+        raise ValueError("Not a little-endian ELF64 file")
+
+    raw = [ELF_SECTION.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+    strtab_offset = raw[shstrndx][4]
+
+    sections = {}
+    for (name, sh_type, _, addr, offset, size, link, _, _, _) in raw:
+        end = data.index(b'\0', strtab_offset + name)
+        label = str(data[strtab_offset + name:end], 'latin-1')
+        sections[label] = (sh_type, addr, offset, size, link)
+    return sections, raw
+
+def elf_symbols(data, sections, raw):
+    for (sh_type, _, offset, size, link) in sections.values():
+        if sh_type != SHT_SYMTAB:
+            continue
+        strtab_offset = raw[link][4]
+        for pos in range(offset, offset + size, ELF_SYMBOL.size):
+            name, info, _, shndx, value, _ = ELF_SYMBOL.unpack_from(data, pos)
+            if shndx == SHN_UNDEF or (info & 0xf) in (STT_SECTION, STT_FILE):
+                continue
+            end = data.index(b'\0', strtab_offset + name)
+            yield str(data[strtab_offset + name:end], 'latin-1'), value, (info >> 4) != STB_LOCAL
+
+def read_symbol_table(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    sections, raw = elf_sections(data)
+
+    # global definitions win over local labels of the same name
+    table = {}
+    for name, value, is_global in elf_symbols(data, sections, raw):
+        if is_global or name not in table:
+            table[name] = value
+    return table
+
+_tables = None
+_fallback = {}
+_by_address = None
+
+def symbol_tables():
+    global _tables
+    if _tables is None:
+        _tables = []
+        for objfile in gdb.objfiles():
+            if objfile.filename is None:
+                continue
+            try:
+                _tables.append(read_symbol_table(objfile.filename))
+            except (OSError, ValueError, struct.error):
+                pass
+    return _tables
+
+def evaluate_address(name):
+    try:
+        return int(gdb.parse_and_eval('(long)&%s' % name)) & 0xffffffffffffffff
+    except gdb.error:
+        return None
+
+def lookup(name):
+    for table in symbol_tables():
+        if name in table:
+            return table[name]
+    if name not in _fallback:
+        _fallback[name] = evaluate_address(name)
+    return _fallback[name]
+
+def sorted_symbols():
+    global _by_address
+    if _by_address is None:
+        pairs = {}
+        for table in reversed(symbol_tables()):
+            for name, value in table.items():
+                pairs[value] = name
+        addresses = sorted(pairs)
+        _by_address = (addresses, [pairs[value] for value in addresses])
+    return _by_address
+
+def symbol_at(addr):
+    # (name, offset) of the closest symbol at or below addr, or None
+    addresses, names = sorted_symbols()
+    i = bisect_right(addresses, addr) - 1
+    if i < 0:
+        return None
+    return names[i], addr - addresses[i]
+
+def parse_address(expr):
+    # A bare symbol name means its address, even for labels that have
+    # no debug info. Anything else is evaluated by gdb.
+    addr = lookup(expr) if expr.isidentifier() else None
+    if addr is None:
+        addr = int(gdb.parse_and_eval(expr)) & 0xffffffffffffffff
+    return addr
+
+def refresh(event=None):
+    global _tables, _by_address
+    _tables = None
+    _by_address = None
+    _fallback.clear()
+
+gdb.events.new_objfile.connect(refresh)
+gdb.events.clear_objfiles.connect(refresh)
@@ -0,0 +1,56 @@
+# Tests for tools/forth.py, run against the gdb stand-in in tools/bench
+#
+# Run with "python3 -m unittest discover -s tools/tests"
+#
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOOLS_DIR, 'bench'))
+sys.path.insert(0, TOOLS_DIR)
+import gdb
+import forth
+import symbols
+
+RODATA = 0x1000
+RODATA_END = 0x2000
+DATA_SEGMENT = 0x10000
+HERE = 0x10100
+
+class DictionaryIndexTest(unittest.TestCase):
+    def setUp(self):
+        gdb.symbol_values['data_segment'] = DATA_SEGMENT
+        symbols.refresh()
+        static = forth.StaticDictionary(RODATA, RODATA_END, {
+            0x1000: forth.Header(0x1000, 0, 0, 'dup'),
+            0x1100: forth.Header(0x1100, 0x1000, 0, 'drop')})
+        # runtime headers come from a previous index, so nothing is read
+        previous = SimpleNamespace(headers={
+            0x10000: forth.Header(0x10000, 0x1100, 0, 'foo'),
+            0x10080: forth.Header(0x10080, 0x10000, 0, 'bar')})
+        self.index = forth.DictionaryIndex(0x10080, HERE, static, previous)
+
+    def tearDown(self):
+        del gdb.symbol_values['data_segment']
+        symbols.refresh()
+
+    def test_words_resolve(self):
+        self.assertEqual(self.index.around(0x1030).name, 'dup')
+        self.assertEqual(self.index.around(0x1150).name, 'drop')
+        self.assertEqual(self.index.around(0x10040).name, 'foo')
+        self.assertEqual(self.index.around(0x100f8).name, 'bar')
+
+    def test_gap_after_rodata_is_no_word(self):
+        self.assertEqual(self.index.end_of(self.index.find('drop')), RODATA_END)
+        self.assertIsNone(self.index.around(RODATA_END))
+        self.assertIsNone(self.index.around(0x8000))
+        self.assertIsNone(self.index.around(DATA_SEGMENT - 1))
+
+    def test_nothing_past_here(self):
+        self.assertIsNone(self.index.around(HERE))
+
+if __name__ == '__main__':
+    unittest.main()
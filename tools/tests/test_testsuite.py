@@ -0,0 +1,43 @@
+# Tests for tools/testsuite.py
+#
+# Run with "python3 -m unittest discover -s tools/tests"
+#
+
+import os
+import sys
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+import testsuite
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.preamble, self.sections = testsuite.read_suite(testsuite.DEFAULT_SUITE)
+        self.suite_length = len(self.preamble) + sum(len(s.lines) for s in self.sections)
+
+    def test_prefix_is_well_below_suite(self):
+        for jobs in (2, 4, 8):
+            groups = testsuite.split_groups(self.sections, jobs)
+            prefixes = testsuite.group_prefixes(self.preamble, self.sections, groups)
+            longest = max(len(prefix) for prefix in prefixes)
+            self.assertLess(longest, self.suite_length // 4, '%d jobs' % jobs)
+
+    def test_definitions_are_replayed_without_checks(self):
+        prefix = testsuite.replay_lines(self.preamble + [line for s in self.sections for line in s.lines])
+        texts = [line.text.strip() for line in prefix]
+        self.assertIn(': gt1 123 ;', texts)
+        self.assertIn('variable v1', texts)
+        self.assertIn(': s= ( addr1 c1 addr2 c2 -- flag )', texts)
+        # a check that stores something is kept whole
+        self.assertIn('t{ 1s 1st ! 1st @ -> 1s     }t', texts)
+        self.assertNotIn('t{ 0 bitsset? -> 0 }t', texts)
+
+    def test_prefix_lines_are_copies(self):
+        groups = testsuite.split_groups(self.sections, 4)
+        reported = {id(line) for s in self.sections for line in s.lines}
+        for prefix in testsuite.group_prefixes(self.preamble, self.sections, groups):
+            self.assertFalse(any(id(line) in reported for line in prefix))
+
+if __name__ == '__main__':
+    unittest.main()
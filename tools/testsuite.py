@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+#
+# Run src/testsuite.f under QEMU, several instances at once
+#
+# Usage:
+#   tools/testsuite.py [--jobs <n>] [--timeout <seconds>] [--section <name>]...
+#                      [--junit <file>] [--json <file>] [<testsuite.f>]
+#
+# The suite is split at its ".\ F.x" headers into sections, and the
+# sections into one contiguous group per job. Each group gets its own
+# QEMU (the same machine "make emulate" runs) and is typed in over
+# -serial stdio one line at a time, just as at the keyboard. The
+# sections are not independent - later ones use words defined by
+# earlier ones - so every group first replays what it needs of the
+# suite ahead of it: every line that is not a test or a comment, and
+# the tests that define or store something (":", CREATE, VARIABLE,
+# CONSTANT, ",", "!" and the like). A replayed test that expects no
+# results is typed without its "t{ ... -> }t", the others as they are.
+# Only the lines of the group's own sections are reported.
+#
+# The kernel echoes each line after its "> " prompt, so the output
+# between the echo of one line and the echo of the next belongs to the
+# first. A test (a line starting with "t{") fails if its output holds
+# one of the ttester messages from src/test.f, or a PARSE ERROR. Any
+# other line that gets a PARSE ERROR is reported as a section error.
+# A group whose QEMU stops echoing for <timeout> seconds, or whose
+# kernel restarts, is killed; its unfinished sections are errors.
+#
+# Results are printed per section, with the time each took, and can be
+# written as JUnit XML and as JSON. The exit status is 1 if anything
+# failed.
+#
+
+import argparse
+import json
+import os
+import re
+import selectors
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SUITE = os.path.join(ROOT_DIR, 'src', 'testsuite.f')
+DEFAULT_KERNEL = os.path.join(ROOT_DIR, 'build', 'kernel-pi3.img')
+DEFAULT_DTB = os.path.join(ROOT_DIR, 'firmware', 'bcm2710-rpi-3-b.dtb')
+DEFAULT_MACHINE = 'raspi3b'
+
+QEMU = ['qemu-system-aarch64', '-semihosting', '-smp', '4']
+
+# what boot1.f prints just before it starts reading the console
+READY = b'READY\r\n'
+
+# how the kernel ends each echoed line
+EOL = b'\r\n'
+
+SECTION = re.compile(r'\.\\\s+(\S+)\s*(.*)')
+TEST = re.compile(r'\s*t\{\s(.*?)\s->\s*(.*?)\s*\}t')
+COMMENT = re.compile(r'(^|\s)(\\\s.*$|\(\s[^)]*\))')
+# words whose effect outlives the test they are in
+DEFINING = re.compile(r'(^|\s)(:|:noname|;|create|variable|constant|value|defer|is|to|does>|immediate|'
+                      r',|c,|allot|align|!|c!|\+!|hex|decimal)(?=\s|$)', re.IGNORECASE)
+FAILURE = re.compile(rb'(incorrect result|wrong number of results) ?:\[')
+PARSE_ERROR = re.compile(rb"PARSE ERROR: '[^']*'")
+
+# typed after the last line, so its output ends at a known place
+SENTINEL = '\\ end of testsuite'
+
+class Line():
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+        stripped = text.strip()
+        self.is_test = stripped.startswith('t{')
+        self.output = None
+        self.time = None
+
+    @property
+    def completed(self):
+        return self.output is not None
+
+class Section():
+    def __init__(self, name, title, number):
+        self.name = name
+        self.title = title
+        self.number = number
+        self.lines = []
+        self.error = None
+        self.end_time = None
+
+def read_suite(filename):
+    # returns the lines ahead of the first section, and the sections
+    preamble = []
+    sections = []
+    with open(filename, encoding='utf-8') as f:
+        for number, text in enumerate(f, 1):
+            text = text.rstrip('\r\n')
+            match = SECTION.match(text)
+            if match:
+                sections.append(Section(match.group(1), ' '.join(match.group(2).split()), number))
+            if sections:
+                sections[-1].lines.append(Line(number, text))
+            else:
+                preamble.append(Line(number, text))
+    return preamble, sections
+
+def replay_lines(lines):
+    # the lines a later group has to type, as copies: other groups
+    # report the originals
+    replay = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if not line.is_test:
+            # blank lines, comments and section headers change nothing
+            if COMMENT.sub(' ', line.text).strip() and not SECTION.match(line.text):
+                replay.append(Line(line.number, line.text))
+            continue
+        # a test runs on to the line holding its }t
+        unit = [line]
+        while '}t' not in unit[-1].text and i < len(lines) and not lines[i].is_test:
+            unit.append(lines[i])
+            i += 1
+        if not any(DEFINING.search(COMMENT.sub(' ', l.text)) for l in unit):
+            continue
+        match = TEST.match(unit[0].text)
+        if len(unit) == 1 and match and not COMMENT.sub(' ', match.group(2)).strip():
+            replay.append(Line(line.number, match.group(1)))
+        else:
+            replay += [Line(l.number, l.text) for l in unit]
+    return replay
+
+def group_prefixes(preamble, sections, groups):
+    # what each group replays of the suite ahead of its first section
+    all_lines = preamble + [line for section in sections for line in section.lines]
+    index = {id(line): i for i, line in enumerate(all_lines)}
+    return [replay_lines(all_lines[:index[id(group[0].lines[0])]]) for group in groups]
+
+def split_groups(sections, jobs):
+    # contiguous runs of sections with about the same number of lines
+    total = sum(len(s.lines) for s in sections)
+    target = max(1, total // max(1, jobs))
+    groups = [[]]
+    size = 0
+    for section in sections:
+        if size >= target and len(groups) < jobs:
+            groups.append([])
+            size = 0
+        groups[-1].append(section)
+        size += len(section.lines)
+    return [group for group in groups if group]
+
+class Transcript():
+    # Matches the console output against the lines typed. Output is fed
+    # in as it arrives; each line's output and the time its echo was
+    # seen are filled in as soon as the next line's echo shows up.
+    def __init__(self, lines):
+        self.lines = lines
+        self.data = bytearray()
+        self.pos = 0
+        self.next = 0
+        self.restarted = False
+
+    def feed(self, data, now):
+        self.data += data
+        while self.next < len(self.lines):
+            echo = b'> ' + self.lines[self.next].text.encode('utf-8') + EOL
+            start = self.data.find(echo, self.pos)
+            if start < 0:
+                break
+            if self.next > 0:
+                self.lines[self.next - 1].output = bytes(self.data[self.pos:start])
+            self.lines[self.next].time = now
+            self.pos = start + len(echo)
+            self.next += 1
+        if self.data.find(READY, self.pos) >= 0:
+            # an exception sends the kernel back through boot1.f
+            self.restarted = True
+
+    @property
+    def done(self):
+        return self.next == len(self.lines)
+
+def qemu_command(args):
+    return QEMU + ['-M', args.machine, '-dtb', args.dtb, '-kernel', args.kernel,
+                   '-serial', 'stdio', '-display', 'none', '-monitor', 'none'] + args.qemu_arg
+
+def feed_input(proc, lines):
+    # the UART only takes what the kernel has room for, so this blocks
+    # on the pipe while the kernel catches up
+    try:
+        for line in lines:
+            proc.stdin.write(line.text.encode('utf-8') + b'\r')
+            proc.stdin.flush()
+    except (BrokenPipeError, ValueError):
+        pass
+
+def run_group(group, prefix, args):
+    # prefix holds the lines from replay_lines() for the suite ahead of
+    # the group's first section
+    lines = list(prefix)
+    lines += [line for section in group for line in section.lines]
+    lines.append(Line(0, SENTINEL))
+    transcript = Transcript(lines)
+
+    started = time.monotonic()
+    proc = subprocess.Popen(qemu_command(args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, cwd=ROOT_DIR)
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+    writer = None
+    booted = None
+    error = None
+    output = bytearray()
+
+    try:
+        last = time.monotonic()
+        while True:
+            # the sentinel only counts once the prompt after it shows up
+            if transcript.done and transcript.data.endswith(b'> '):
+                break
+            if transcript.restarted:
+                error = 'kernel restarted'
+                break
+            if time.monotonic() - last > args.timeout:
+                error = 'timed out after %d seconds without output' % args.timeout
+                break
+            if not selector.select(timeout=0.5):
+                continue
+            data = os.read(proc.stdout.fileno(), 65536)
+            if not data:
+                error = 'QEMU exited with status %s' % proc.wait()
+                break
+            now = time.monotonic()
+            last = now
+
+            if booted is None:
+                output += data
+                ready = output.find(READY)
+                if ready < 0:
+                    continue
+                booted = now - started
+                data = bytes(output[ready + len(READY):])
+                writer = threading.Thread(target=feed_input, args=(proc, lines), daemon=True)
+                writer.start()
+            transcript.feed(data, now)
+    except OSError as e:
+        error = str(e)
+    finally:
+        selector.close()
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        if writer is not None:
+            writer.join(timeout=1)
+        proc.stdin.close()
+
+    # a section ends when the echo of the line after it shows up
+    following = [group[i + 1].lines[0] for i in range(len(group) - 1)] + [lines[-1]]
+    for section, line in zip(group, following):
+        section.end_time = line.time
+        if not section.lines[-1].completed:
+            section.error = error or 'did not finish'
+    return booted
+
+def line_status(line):
+    if not line.completed:
+        return 'error', 'not run'
+    match = FAILURE.search(line.output) or PARSE_ERROR.search(line.output)
+    if match:
+        return 'failure', match.group(0).decode('utf-8', 'replace').rstrip(' :[')
+    return 'passed', None
+
+def section_time(section):
+    if section.lines[0].time is None or section.end_time is None:
+        return None
+    return section.end_time - section.lines[0].time
+
+def section_result(section, boot_time):
+    tests = []
+    errors = []
+    if section.error:
+        errors.append(section.error)
+    for line in section.lines:
+        status, message = line_status(line)
+        output = line.output.decode('utf-8', 'replace').strip() if line.completed else ''
+        if line.is_test:
+            tests.append({'line': line.number, 'source': line.text.strip(),
+                          'status': status, 'message': message, 'output': output})
+        elif status == 'failure':
+            errors.append('line %d: %s' % (line.number, output))
+    return {'name': section.name,
+            'title': section.title,
+            'line': section.number,
+            'time': section_time(section),
+            'boot_time': boot_time,
+            'tests': tests,
+            'errors': errors}
+
+def totals(results):
+    counts = {'tests': 0, 'passed': 0, 'failures': 0, 'errors': 0}
+    for result in results:
+        for test in result['tests']:
+            counts['tests'] += 1
+            counts['passed' if test['status'] == 'passed' else
+                   'failures' if test['status'] == 'failure' else 'errors'] += 1
+        counts['errors'] += len(result['errors'])
+    return counts
+
+def write_junit(filename, results):
+    root = ElementTree.Element('testsuites')
+    for result in results:
+        counts = totals([result])
+        suite = ElementTree.SubElement(root, 'testsuite', {
+            'name': '%s %s' % (result['name'], result['title']),
+            'tests': str(counts['tests']),
+            'failures': str(counts['failures']),
+            'errors': str(counts['errors']),
+            'time': '%.3f' % (result['time'] or 0.0)})
+        for test in result['tests']:
+            case = ElementTree.SubElement(suite, 'testcase', {
+                'classname': 'testsuite.' + result['name'],
+                'name': 'line %d: %s' % (test['line'], test['source'])})
+            if test['status'] == 'failure':
+                ElementTree.SubElement(case, 'failure', {'message': test['message']}).text = test['output']
+            elif test['status'] == 'error':
+                ElementTree.SubElement(case, 'error', {'message': test['message']})
+        for error in result['errors']:
+            case = ElementTree.SubElement(suite, 'testcase', {
+                'classname': 'testsuite.' + result['name'], 'name': 'section'})
+            ElementTree.SubElement(case, 'error', {'message': error})
+    ElementTree.ElementTree(root).write(filename, encoding='utf-8', xml_declaration=True)
+
+def report(results, out):
+    for result in results:
+        counts = totals([result])
+        elapsed = '%8.2fs' % result['time'] if result['time'] is not None else '%9s' % '-'
+        print('%-14s %-32s %s %4d tests %3d failed %3d errors' %
+              (result['name'], result['title'][:32], elapsed,
+               counts['tests'], counts['failures'], counts['errors']), file=out)
+        for test in result['tests']:
+            if test['status'] != 'passed':
+                print('    line %d: %s: %s' % (test['line'], test['message'], test['source']), file=out)
+        for error in result['errors']:
+            print('    %s' % error, file=out)
+
+    counts = totals(results)
+    print('%d tests, %d passed, %d failed, %d errors' %
+          (counts['tests'], counts['passed'], counts['failures'], counts['errors']), file=out)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Run src/testsuite.f under QEMU')
+    parser.add_argument('suite', nargs='?', default=DEFAULT_SUITE, help='the test suite (default: src/testsuite.f)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='QEMU instances to run at once')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='seconds without output before an instance is killed')
+    parser.add_argument('--section', action='append', default=[],
+                        help='only report sections whose name starts with this (repeatable)')
+    parser.add_argument('--kernel', default=DEFAULT_KERNEL)
+    parser.add_argument('--dtb', default=DEFAULT_DTB)
+    parser.add_argument('--machine', default=DEFAULT_MACHINE)
+    parser.add_argument('--qemu-arg', action='append', default=[], help='extra argument for QEMU (repeatable)')
+    parser.add_argument('--junit', help='write a JUnit XML report to this file')
+    parser.add_argument('--json', help='write a JSON report to this file')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.kernel):
+        parser.error('no kernel at %s; run make first' % args.kernel)
+
+    preamble, sections = read_suite(args.suite)
+    selected = [s for s in sections if not args.section or any(s.name.startswith(p) for p in args.section)]
+    if not selected:
+        parser.error('no sections match')
+
+    groups = split_groups(selected, args.jobs)
+    prefixes = group_prefixes(preamble, sections, groups)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        futures = [pool.submit(run_group, group, prefix, args)
+                   for group, prefix in zip(groups, prefixes)]
+        boot_times = [future.result() for future in futures]
+    elapsed = time.monotonic() - started
+
+    results = [section_result(section, boot_time)
+               for group, boot_time in zip(groups, boot_times) for section in group]
+
+    counts = report(results, sys.stdout)
+    print('%d sections in %d QEMU instances, %.1fs' % (len(results), len(groups), elapsed))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'suite': os.path.relpath(args.suite, ROOT_DIR),
+                       'kernel': os.path.relpath(args.kernel, ROOT_DIR),
+                       'instances': len(groups),
+                       'time': elapsed,
+                       'totals': counts,
+                       'sections': results}, f, indent=2)
+    if args.junit:
+        write_junit(args.junit, results)
+
+    return 0 if counts['failures'] == 0 and counts['errors'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+# Summarize a QEMU USB/DWC2 trace log
+#
+# Usage:
+#   tools/usbtrace.py [--top N] [<log> ...]
+#
+# Enable the events with etc/trace_events_usb.txt (copy it over
+# etc/trace_events.txt, or point -trace events= at it) and send QEMU's
+# stderr to a file. With no file, or "-", the log is read from stdin;
+# files ending in .gz are decompressed on the fly.
+#
+# The log is read once, line by line, through a chain of generators.
+# Memory use depends only on the number of channels and register names,
+# never on the length of the log, so multi-gigabyte logs are fine.
+#
+# Reported:
+#   - latency from usb_dwc2_async_packet to the matching
+#     usb_dwc2_async_packet_complete on the same channel, as a histogram
+#     with power-of-two microsecond buckets
+#   - per-channel packets, bytes and throughput
+#   - the most frequently accessed DWC2 registers
+#
+# Latencies and throughput need the "pid@seconds.micros:" prefix that
+# QEMU's log backend puts on each line; without it only counts are given.
+#
+
+import argparse
+import gzip
+import re
+import sys
+from collections import Counter, namedtuple
+
+TraceEvent = namedtuple('TraceEvent', ['time', 'name', 'args'])
+
+LINE = re.compile(r'(?:\d+@(\d+)\.(\d+):)?(usb_dwc2_\w+)\s?(.*)')
+CHANNEL = re.compile(r'\bch (\d+)')
+LENGTH = re.compile(r'\blen (\d+)')
+REGISTER = re.compile(r'(0x[0-9a-fA-F]+) (\S+) val')
+
+# bucket i holds latencies of [2^(i-1), 2^i) microseconds
+HISTOGRAM_WIDTH = 50
+
+def read_lines(paths):
+    for path in paths or ['-']:
+        if path == '-':
+            yield from sys.stdin
+        elif path.endswith('.gz'):
+            with gzip.open(path, 'rt', encoding='latin-1') as f:
+                yield from f
+        else:
+            with open(path, encoding='latin-1', buffering=1 << 20) as f:
+                yield from f
+
+def parse_events(lines):
+    for line in lines:
+        # cheap test first, most lines in a mixed log are something else
+        if 'usb_dwc2_' not in line:
+            continue
+        m = LINE.search(line)
+        if m is None:
+            continue
+        seconds, micros, name, args = m.groups()
+        time = int(seconds) + int(micros) / 1e6 if seconds is not None else None
+        yield TraceEvent(time, name, args)
+
+def field(pattern, args):
+    m = pattern.search(args)
+    return int(m.group(1)) if m else None
+
+class PacketLatency():
+    def __init__(self):
+        self.pending = {}
+        self.histogram = Counter()
+        self.packets = Counter()
+        self.bytes = Counter()
+        self.unmatched = 0
+        self.overwritten = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self, event):
+        chan = field(CHANNEL, event.args)
+        if chan in self.pending:
+            self.overwritten += 1
+        self.pending[chan] = event.time
+
+    def complete(self, event):
+        chan = field(CHANNEL, event.args)
+        self.packets[chan] += 1
+        self.bytes[chan] += field(LENGTH, event.args) or 0
+
+        if chan not in self.pending:
+            self.unmatched += 1
+            return
+        started = self.pending.pop(chan)
+        if started is None or event.time is None:
+            return
+        latency = event.time - started
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.histogram[int(latency * 1e6).bit_length()] += 1
+
+class RegisterAccess():
+    def __init__(self):
+        self.counts = Counter()
+
+    def access(self, event):
+        m = REGISTER.search(event.args)
+        reg = m.group(2) if m else '?'
+        kind = 'write' if event.name.endswith('_write') else 'read'
+        self.counts[(reg, kind)] += 1
+
+def analyze(events):
+    latency = PacketLatency()
+    registers = RegisterAccess()
+    names = Counter()
+    first = last = None
+
+    handlers = {
+        'usb_dwc2_async_packet': latency.start,
+        'usb_dwc2_async_packet_complete': latency.complete,
+    }
+    for event in events:
+        names[event.name] += 1
+        if event.time is not None:
+            if first is None:
+                first = event.time
+            last = event.time
+
+        handler = handlers.get(event.name)
+        if handler is not None:
+            handler(event)
+        elif event.name.endswith('_read') or event.name.endswith('_write'):
+            if 'reg' in event.name:
+                registers.access(event)
+
+    span = (last - first) if first is not None else None
+    return names, latency, registers, span
+
+def bucket_label(i):
+    if i == 0:
+        return '< 1us'
+    return '%d-%dus' % (1 << (i - 1), 1 << i)
+
+def report(names, latency, registers, span, top):
+    lines = ['%d events' % sum(names.values())]
+    if span is not None:
+        lines[0] += ' over %.6f s' % span
+
+    completed = sum(latency.histogram.values())
+    lines.append('')
+    lines.append('Async packet latency (%d paired, %d completions without a start, '
+                 '%d starts overwritten, %d still pending)' %
+                 (completed, latency.unmatched, latency.overwritten, len(latency.pending)))
+    if completed:
+        most = max(latency.histogram.values())
+        for i in range(min(latency.histogram), max(latency.histogram) + 1):
+            count = latency.histogram[i]
+            bar = '#' * ((count * HISTOGRAM_WIDTH + most - 1) // most)
+            lines.append('  %12s %10d %s' % (bucket_label(i), count, bar))
+        lines.append('  mean %.1fus, max %.1fus' %
+                     (1e6 * latency.total_latency / completed, 1e6 * latency.max_latency))
+
+    lines.append('')
+    lines.append('Channels')
+    lines.append('  %4s %10s %12s %12s' % ('ch', 'packets', 'bytes', 'bytes/s'))
+    for chan in sorted(latency.packets, key=lambda c: -1 if c is None else c):
+        rate = '%12.0f' % (latency.bytes[chan] / span) if span else '%12s' % '-'
+        lines.append('  %4s %10d %12d %s' % ('?' if chan is None else chan,
+                                             latency.packets[chan], latency.bytes[chan], rate))
+
+    lines.append('')
+    lines.append('Register hot spots')
+    for (reg, kind), count in registers.counts.most_common(top):
+        lines.append('  %-16s %-5s %10d' % (reg, kind, count))
+
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a QEMU USB/DWC2 trace log')
+    parser.add_argument('logs', nargs='*', help='trace logs (default: stdin)')
+    parser.add_argument('--top', type=int, default=20, help='register hot spots to list')
+    args = parser.parse_args()
+
+    print(report(*analyze(parse_events(read_lines(args.logs))), args.top))
+
+if __name__ == '__main__':
+    main()
@@ -7,137 +7,352 @@
 #   print_word       - print info about the word at the given address
 #   find_word        - locate a word by name (string)
 #   find_word_around - locate a word that contains the given address
+#   see              - decompile a word
+#   xref             - list the colon definitions that call a word
+#   check_dictionary - check every header on the link chain for bad
+#                      links, name lengths, flags and cycles
+#   fbt              - print a backtrace of the Forth return stack
+#   stacks [-f] [<n>] - print the parameter and return stacks, top
+#                      first (at most <n> cells of each), naming the
+#                      words that cells point into. -f reads the whole
+#                      of each stack again instead of refreshing it.
+#
+# Settings:
+#   check-dictionary <bool>
+#     When true, check_dictionary runs on every stop and reports any
+#     problem it finds. Defaults to false.
+#   forth-stacks <bool>
+#     When true, stacks runs on every stop. Defaults to false.
+#
+# There is also a frame filter, 'forth-return-stack', that shows the
+# Forth return stack under the newest frame in gdb's own backtrace. It
+# is off by default; turn it on with
+#   enable frame-filter global forth-return-stack
+#
+# The lookups work from the dictionary index in forth.py, which costs no
+# target I/O between stops. xref uses the cross reference index there,
+# which is saved between sessions and extended as words are defined.
+# stacks keeps its copy of each stack and its own dictionary index from
+# one stop to the next, and only reads what moved (see forth.py), which
+# keeps stepping with forth-stacks on fast over a slow link.
 #
 
 import gdb
-import re
+from gdb.FrameDecorator import FrameDecorator
+import os
+import sys
 
-def get_symbol_address(symbol_name):
-    output = gdb.execute("info variables", to_string=True)
-    pattern = rf"(0x[0-9a-fA-F]+)\s+{re.escape(symbol_name)}"
-    match = re.search(pattern, output, re.MULTILINE)
-
-    if match:
-        address = match.group(1)
-        return int(address, 16)
-    else:
-        return None
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import forth
+import memory
+import stats
+import symbols
 
 def word_name(addr):
-    inferior = gdb.selected_inferior()
-    mem = inferior.read_memory(addr, 40)
-    namelen = int.from_bytes(mem[9])
-    return str(mem[10:10+namelen], 'latin-1')
+    return forth.read_header(addr).name
 
-def print_word(addr):
-    # word header is 40 bytes long
-    # 0 - 7: link address
-    #     8: flags
-    #     9: name length
-    # 10-40: name chars, padded with ','
-    inferior = gdb.selected_inferior()
-    mem = inferior.read_memory(addr, 40)
-    link = deref(addr)
-    flags = int.from_bytes(mem[8])
-    if (flags & 0x80):
+def print_header(header):
+    if (header.flags & forth.F_IMMED):
         iflag = 'i'
     else:
         iflag = ' '
-    if (flags & 0x20):
+    if (header.flags & forth.F_HIDDEN):
         hflag = 'h'
     else:
         hflag = ' '
-    namelen = int.from_bytes(mem[9])
-    name = str(mem[10:10+namelen], 'latin-1').ljust(40)
+    name = header.name.ljust(40)
 
-    print('0x%x\t%c %c %s (link 0x%x)' % (addr, iflag, hflag, name, link))
+    print('0x%x\t%c %c %s (link 0x%x)' % (header.addr, iflag, hflag, name, header.link))
 
-def deref(addr):
-    inf = gdb.selected_inferior()
-    mem = inf.read_memory(addr, 8)
-    return int.from_bytes(mem, byteorder='little')
+def print_word(addr):
+    print_header(forth.read_header(int(addr)))
 
 def word_before(addr):
-    return deref(addr)
+    return forth.deref(addr)
 
-def get_latest():
-    p_latest = get_symbol_address('var_latest')
-
-    if p_latest is None:
-        raise ValueError("Cannot locate var_latest")
-    else:
-        return deref(p_latest)
-
-class PrintWord(gdb.Command):
+class PrintWord(stats.Command):
     def __init__(self):
         super (PrintWord, self).__init__('print_word', gdb.COMMAND_USER)
 
     def invoke(self, arg, from_tty):
         argv = gdb.string_to_argv(arg)
-        addr = gdb.parse_and_eval(argv[0]).cast(gdb.lookup_type('void').pointer())
+        addr = symbols.parse_address(argv[0])
 
         print_word(addr)
 
-class Latest(gdb.Command):
+class Latest(stats.Command):
     def __init__(self):
         super (Latest, self).__init__('latest', gdb.COMMAND_USER)
 
     def invoke(self, arg, from_tty):
-        print(hex(get_latest()))
+        print(hex(forth.get_latest()))
 
-class FindWord(gdb.Command):
+class FindWord(stats.Command):
     def __init__(self):
         super(FindWord,self).__init__('find_word', gdb.COMMAND_USER)
 
     def invoke(self, arg, from_tty):
         target = gdb.string_to_argv(arg)[0]
 
-        p_latest = get_latest()
+        header = forth.get_dictionary().find(target)
+        if header is None:
+            print(f"Cannot locate {target}")
+        else:
+            print_header(header)
+
+class WordAround(stats.Command):
+    def __init__(self):
+        super(WordAround,self).__init__('find_word_around', gdb.COMMAND_USER)
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        addr = symbols.parse_address(argv[0])
+
+        header = forth.get_dictionary().around(addr)
+        if header is None:
+            print(f"Cannot locate word around {addr:#x}")
+        else:
+            print_header(header)
+
+def see(header):
+    dictionary = forth.get_dictionary()
+    cfa = header.addr + forth.HEADER_SIZE
+    end = dictionary.end_of(header)
+    if end is None or end - cfa > forth.MAX_BODY:
+        end = cfa + forth.MAX_BODY
+
+    data = memory.read(cfa, end - cfa)
+    codeword = int.from_bytes(data[0:forth.CELL], byteorder='little')
+
+    print_header(header)
+    if codeword == symbols.lookup('docol'):
+        print(': %s' % header.name)
+        for addr, text in forth.decompile_body(dictionary, cfa + forth.CELL, data[forth.CELL:]):
+            print('  0x%x  %s' % (addr, text))
+        print(';')
+    elif codeword in (symbols.lookup('dovar'), symbols.lookup('doval')):
+        kind = 'variable' if codeword == symbols.lookup('dovar') else 'value'
+        value = int.from_bytes(data[forth.CELL:2*forth.CELL], byteorder='little')
+        print('%s %s  ( data at 0x%x = %s )' % (kind, header.name, cfa + forth.CELL, forth.format_number(value)))
+    elif dictionary.around(codeword) is not None:
+        parent = dictionary.around(codeword)
+        print('%s  ( does> word, behavior in %s at 0x%x, data at 0x%x )' % (header.name, parent.name, codeword, cfa + forth.CELL))
+    else:
+        print('code %s  ( code at 0x%x )' % (header.name, codeword))
+
+class See(stats.Command):
+    def __init__(self):
+        super(See,self).__init__('see', gdb.COMMAND_USER)
 
-        if p_latest is None:
-            print("Cannot locate var_latest")
+    def invoke(self, arg, from_tty):
+        target = gdb.string_to_argv(arg)[0]
+
+        header = forth.get_dictionary().find(target)
+        if header is None:
+            print(f"Cannot locate {target}")
         else:
-            prev = p_latest
+            see(header)
 
-            while prev != 0:
-                curr = prev
-                prev = word_before(curr)
+class CrossReference(stats.Command):
+    def __init__(self):
+        super(CrossReference,self).__init__('xref', gdb.COMMAND_USER)
 
-                name = word_name(curr)
-                if name == target:
-                    print_word(curr)
-                    return
+    def invoke(self, arg, from_tty):
+        target = gdb.string_to_argv(arg)[0]
+
+        dictionary = forth.get_dictionary()
+        header = dictionary.find(target)
+        if header is None:
             print(f"Cannot locate {target}")
+            return
+
+        callers = forth.get_cross_reference().callers_of(header)
+        for site, caller in sorted(callers):
+            name = dictionary.headers[caller].name if caller in dictionary.headers else '??'
+            print('0x%x\t%s+%d' % (site, name, site - caller - forth.HEADER_SIZE))
+        print('%d call sites in %d words' % (len(callers), len(set(caller for _, caller in callers))))
 
-class WordAround(gdb.Command):
+def check_dictionary(verbose):
+    here = forth.get_here()
+    count, problems = forth.check_dictionary(forth.get_latest(), forth.dictionary_regions(here))
+    for addr, problem in problems:
+        print('0x%x\t%s' % (addr, problem))
+    if problems or verbose:
+        print('%d headers walked, %d problems' % (count, len(problems)))
+
+class CheckDictionary(stats.Command):
     def __init__(self):
-        super(WordAround,self).__init__('find_word_around', gdb.COMMAND_USER)
+        super(CheckDictionary,self).__init__('check_dictionary', gdb.COMMAND_USER)
+
+    def invoke(self, arg, from_tty):
+        check_dictionary(True)
+
+class CheckDictionaryOnStop(gdb.Parameter):
+    def __init__(self):
+        super(CheckDictionaryOnStop, self).__init__('check-dictionary',
+                                                    gdb.COMMAND_DATA,
+                                                    gdb.PARAM_BOOLEAN)
+        self.value = False
+
+    set_doc = 'Determines if the dictionary is checked on every stop'
+    show_doc = 'Checking the dictionary on every stop is'
+
+def check_dictionary_on_stop(event):
+    if not gdb.parameter('check-dictionary'):
+        return
+    try:
+        check_dictionary(False)
+    except (gdb.error, ValueError) as e:
+        print('check_dictionary: %s' % e)
+
+class ForthBacktrace(stats.Command):
+    def __init__(self):
+        super(ForthBacktrace,self).__init__('fbt', gdb.COMMAND_STACK)
+
+    def invoke(self, arg, from_tty):
+        lines = []
+        for frame in forth.forth_frames():
+            where = 'NIP' if frame.slot is None else 'rsp 0x%x' % frame.slot
+            lines.append('#%-3d 0x%016x in %-30s [%s]' % (frame.level, frame.ip, forth.frame_label(frame), where))
+        print('\n'.join(lines))
+
+_stack_dictionary = None
+
+def stack_dictionary():
+    # rebuilt only when latest or here moves, reusing the headers
+    # already read
+    global _stack_dictionary
+    latest = forth.get_latest()
+    here = forth.get_here()
+    previous = _stack_dictionary
+    if previous is None or previous.latest != latest or previous.here != here:
+        _stack_dictionary = forth.DictionaryIndex(latest, here, forth.get_static_dictionary(), previous)
+    return _stack_dictionary
+
+def invalidate_stack_dictionary(event=None):
+    global _stack_dictionary
+    _stack_dictionary = None
+
+def cell_label(dictionary, value):
+    header = dictionary.by_cfa.get(value)
+    if header is not None:
+        return "' " + header.name
+    header = dictionary.around(value)
+    if header is not None:
+        return '%s+%d' % (header.name, value - header.addr - forth.HEADER_SIZE)
+    return forth.format_number(value)
+
+def print_stack(mirror, label, max_cells):
+    cells = mirror.cells()
+    print('%s: %d cells (0x%x - 0x%x)' % (label, len(cells), mirror.pointer, mirror.base))
+    dictionary = stack_dictionary()
+    lines = []
+    for i, value in enumerate(cells[:max_cells]):
+        lines.append('  %3d  0x%016x  %s' % (i, value, cell_label(dictionary, value)))
+    if max_cells is not None and len(cells) > max_cells:
+        lines.append('  ... %d more' % (len(cells) - max_cells))
+    if lines:
+        print('\n'.join(lines))
+
+def print_stacks(full=False, max_cells=None):
+    for mirror, label in ((forth.parameter_stack, 'Parameter stack'),
+                          (forth.return_stack, 'Return stack')):
+        mirror.refresh(full)
+        print_stack(mirror, label, max_cells)
+
+class Stacks(stats.Command):
+    def __init__(self):
+        super(Stacks,self).__init__('stacks', gdb.COMMAND_STACK)
 
     def invoke(self, arg, from_tty):
         argv = gdb.string_to_argv(arg)
-        addr = gdb.parse_and_eval(argv[0]).cast(gdb.lookup_type('void').pointer())
 
-        p_latest = get_latest()
+        full = '-f' in argv
+        argv = [a for a in argv if a != '-f']
+        if len(argv) > 1:
+            raise gdb.GdbError('Usage: stacks [-f] [<max cells>]')
+        max_cells = int(gdb.parse_and_eval(argv[0])) if argv else None
 
-        if p_latest is None:
-            print("Cannot locate var_latest")
-        else:
-            prev = p_latest
+        print_stacks(full, max_cells)
 
-            while prev != 0:
-                curr = prev
-                prev = word_before(curr)
+class StacksOnStop(gdb.Parameter):
+    def __init__(self):
+        super(StacksOnStop, self).__init__('forth-stacks',
+                                           gdb.COMMAND_STACK,
+                                           gdb.PARAM_BOOLEAN)
+        self.value = False
+
+    set_doc = 'Determines if the Forth stacks are shown on every stop'
+    show_doc = 'Showing the Forth stacks on every stop is'
+
+def stacks_on_stop(event):
+    if not gdb.parameter('forth-stacks'):
+        return
+    try:
+        gdb.execute('stacks')
+    except (gdb.error, gdb.GdbError, ValueError) as e:
+        print('stacks: %s' % e)
+
+class ForthFrameDecorator(FrameDecorator):
+    def __init__(self, base, frame):
+        super(ForthFrameDecorator, self).__init__(base)
+        self.frame = frame
+
+    def function(self):
+        return 'forth ' + forth.frame_label(self.frame)
 
-                if prev == 0:
-                    break
-                
-                if prev <= addr < curr:
-                    print_word(prev)
-                    return
-            print(f"Cannot locate word around {addr}")
+    def address(self):
+        return self.frame.ip
+
+    def filename(self):
+        return None
+
+    def line(self):
+        return None
+
+    def frame_args(self):
+        return None
+
+    def frame_locals(self):
+        return None
+
+class ForthNewestFrameDecorator(FrameDecorator):
+    def __init__(self, base):
+        super(ForthNewestFrameDecorator, self).__init__(base)
+        self.base = base
+
+    def elided(self):
+        try:
+            frames = list(forth.forth_frames())
+        except (gdb.error, gdb.GdbError, ValueError):
+            return None
+        return iter([ForthFrameDecorator(self.base, frame) for frame in frames])
+
+class ForthFrameFilter():
+    def __init__(self):
+        self.name = 'forth-return-stack'
+        self.priority = 100
+        self.enabled = False
+        gdb.frame_filters[self.name] = self
+
+    def filter(self, frame_iter):
+        for i, frame in enumerate(frame_iter):
+            yield ForthNewestFrameDecorator(frame) if i == 0 else frame
 
-            
 PrintWord()
 Latest()
 FindWord()
 WordAround()
+See()
+CrossReference()
+CheckDictionary()
+CheckDictionaryOnStop()
+ForthBacktrace()
+Stacks()
+StacksOnStop()
+ForthFrameFilter()
+
+gdb.events.stop.connect(check_dictionary_on_stop)
+gdb.events.stop.connect(stacks_on_stop)
+gdb.events.memory_changed.connect(invalidate_stack_dictionary)
+memory.source_listeners.append(invalidate_stack_dictionary)